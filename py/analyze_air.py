@@ -3,15 +3,19 @@
 
 ## This script is to run greedy algorithm for geodesic
 
+import os
 import csv
 import time
 import random
 import pickle
 import networkx as nx
-from collections import Counter
-import pycountry_convert as pc
 from geopy.distance import geodesic as GD
 
+import greedy
+import geodist
+import decision_matrix
+import landmarks
+
 from typing import (
     Any,
     AnyStr,
@@ -28,6 +32,8 @@ from typing import (
     Tuple,
 )
 
+FPATH_LM_DISTANCE = ["../pickle/lm_dist.pickle", "../pickle/lm_dist.npy"]  # first existing one is used by main()
+
 def load_anchors(fname: str) -> list:
     anchors = []
    
@@ -41,106 +47,46 @@ def load_anchors(fname: str) -> list:
 
 Landmark = Dict[str, Any]
 def load_landmarks(fname: str) -> (Landmark, dict):
-    rv = {}  # {pid(str): (longitude(float), ltitude(float))
-    anchors_by_cnt = {} # {country: [list of anchors])
-    with open(fname, "rt") as fp:
-        rd = csv.DictReader(fp)
-        for row in rd:
-            pid = int(row['pid'].strip())
-            longitude = float(row['longitude'].strip())
-            latitude = float(row['latitude'].strip())
-            rv[pid] = (latitude, longitude)
-            if row['country'] not in anchors_by_cnt:
-                anchors_by_cnt[row['country']] = []
-            anchors_by_cnt[row['country']].append(int(row['pid']))
+    index = landmarks.load(fname)
+    rv = dict(index.coordinates)  # {pid(str): (longitude(float), ltitude(float))
+    anchors_by_cnt = {cnt: list(pids) for cnt, pids in index.groups('country').items()}  # {country: [list of anchors])
     return rv, anchors_by_cnt
 
 
-def get_geo_results(fpath: str) -> dict:
-    geo_results = {'anchors': [], 'anchors_decision': {}, 'final_decision': {}}
+def get_geo_results(fpath: str, as_matrix: bool = False):
+    """
+    Args:
+        fpath: final_result.csv, parsed once into an int8 matrix cached next to it (see decision_matrix.py)
+        as_matrix: True (the valid rows as a decision_matrix.DecisionMatrix), False (nested dicts below)
+    """
+    matrix = decision_matrix.load(fpath)
+    assert matrix.decision.shape[1] == 780  # "some data is missing!"
+    valid = matrix.valid(0.6)
+    print(f"{len(matrix.vpns) - len(set(valid.vpns.tolist()))}/{len(matrix.vpns)} has been removed.")
+    print()
+    if as_matrix:
+        return valid
+
+    geo_results = {'anchors': matrix.anchors.tolist(), 'anchors_decision': {}, 'final_decision': {}}
     # { "anchors: [prb_id, ....] // total 780
     #   "anchors_decision": {"vpn_id": {"prb_id": [T/F]}},
     #   "final_decision": {"vpn_id": T/F}
-    count = 0
-    with open(fpath, "r") as f:
-        reader = csv.DictReader(f)
-        header = reader.fieldnames
-        for prb_id in header[1:-1]:
-            geo_results['anchors'].append(int(prb_id))
-
-        for row in reader:
-            count += 1
-            counting = Counter(list(row.values())[1:-1])
-            # check suspicious cases
-            total_results = sum(counting.values())
-            assert total_results == 780  # "some data is missing!"
-            valid_results = 0
-            if 'False' in counting:
-                valid_results += counting['False']
-            if 'True' in counting:
-                valid_results += counting['True']
-            if valid_results / total_results <= 0.6:
-                # print("valid results are only: ",  valid_results/total_results, counting)
-                continue
-            # record
-            geo_results['final_decision'][row["VPN_IP"]] = row['final']
-            geo_results['anchors_decision'][row['VPN_IP']] = {}
-            for prb_id in header[1:-1]:
-                geo_results['anchors_decision'][row['VPN_IP']][int(prb_id)] = row[prb_id]
-            assert counting == Counter(list(geo_results['anchors_decision'][row['VPN_IP']].values()))
-
-    print(f"{count - len(geo_results['final_decision'])}/{count} has been removed.")
-    print()
+    labels = valid.labels
+    for vpn, decisions, final in zip(valid.vpns.tolist(), valid.decision.tolist(), valid.final.tolist()):
+        geo_results['final_decision'][vpn] = labels[final]
+        geo_results['anchors_decision'][vpn] = dict(zip(geo_results['anchors'], (labels[d] for d in decisions)))
     return geo_results
 
 
 def get_landmarks(fpath: str, anchors_from_exp: list) -> dict:
-    abc = {'city': {}, 'country': {}, 'asn': {}, 'continent': {}, 'anchors': []}
+    index = landmarks.load(fpath).subset(anchors_from_exp)
+    abc = index.categories
     # anchor by category {'city': {city_name: [ ]},
     #                   'country': {cnt_name: []},
     #                   'asn': {asn_num: []},
     #                   'continent': {'continent_name':[]}}
-    
-    cnt_by_continent = {}
-    
-    with open(fpath, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if int(row['pid']) not in anchors_from_exp:
-                continue
-            abc['anchors'].append(int(row['pid']))
-            
-            if row['city'] not in abc['city']:
-                abc['city'][row['city']] = []
-            abc['city'][row['city']].append(int(row['pid']))
-            
-            if row['country'] not in abc['country']:
-                abc['country'][row['country']] = []
-            abc['country'][row['country']].append(int(row['pid']))
-            
-            if int(row['asn']) not in abc['asn']:
-                abc['asn'][int(row['asn'])] = []
-            abc['asn'][int(row['asn'])].append(int(row['pid']))
-            
-            if row['country'] == 'SX':
-                conti_code = 'NA'
-            else:
-                conti_code = pc.country_alpha2_to_continent_code(row['country'])
-            
-            conti_name = pc.convert_continent_code_to_continent_name(conti_code)
-            if conti_name not in abc['continent']:
-                abc['continent'][conti_name] = []
-            abc['continent'][conti_name].append(int(row['pid']))
-            
-            if conti_name not in cnt_by_continent:
-                cnt_by_continent[conti_name] = {}
-            if row['country'] not in cnt_by_continent[conti_name]:
-                cnt_by_continent[conti_name][row['country']] = []
-            cnt_by_continent[conti_name][row['country']].append(int(row['pid']))
-            # if row['city'] not in cnt_by_continent[conti_name]:
-            #     cnt_by_continent[conti_name][row['city']] = []
-            # cnt_by_continent[conti_name][row['city']].append(int(row['pid']))
-    
+
+    cnt_by_continent = index.countries_by_continent
     with open("../pickle/country_by_continent.pickle", "wb") as f:
         pickle.dump(cnt_by_continent, f)
     
@@ -150,28 +96,21 @@ def get_landmarks(fpath: str, anchors_from_exp: list) -> dict:
     return abc
 
 def get_landmarks_meta(fpath: str, anchors_from_exp: list) -> dict:
-    lm_meta = {}
+    lm_meta = landmarks.load(fpath).subset(anchors_from_exp).meta
     #  {pid: {'city': str, 'country': str, 'asn': str, 'continent': str]
-
-    with open(fpath, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if int(row['pid']) not in anchors_from_exp:
-                continue
-            row['pid'] = int(row['pid'])
-            lm_meta[row['pid']] = {}
-            lm_meta[row['pid']]['city'] = row['city']
-            lm_meta[row['pid']]['country'] = row['country']
-            lm_meta[row['pid']]['asn'] = row['asn']
-            if row['country'] == 'SX':
-                conti_code = 'NA'
-            else:
-                conti_code = pc.country_alpha2_to_continent_code(row['country'])
-            conti_name = pc.convert_continent_code_to_continent_name(conti_code)
-            lm_meta[row['pid']]['continent'] =conti_name
     return lm_meta
 
-def select_starting_anchor_for_vp(fpath_vpconfig: str, fpath_distance: str, anchors_by_cnt: dict, G) -> dict:
+def select_starting_anchor_for_vp(fpath_vpconfig: str, fpath_distance: str, anchors_by_cnt: dict, G,
+                                  fpath_cache: Optional[str] = None, seed: Optional[int] = None) -> dict:
+    """
+    Args:
+        fpath_vpconfig: VPN servers with their claimed country
+        fpath_distance: distance of every anchor to every country
+        anchors_by_cnt: {iso2: [pid, ...]}
+        G: anchor graph
+        fpath_cache: where the per-country ranking of anchors is kept, e.g. next to the graph file
+        seed: seed of the draw among the anchors of the claimed country (None: a different draw every run)
+    """
     iso3t2 = {}
     # iso2t3 = {}
     with open("../iso3166.csv", "r") as f:
@@ -180,65 +119,85 @@ def select_starting_anchor_for_vp(fpath_vpconfig: str, fpath_distance: str, anch
             iso3t2[r['ISO_A3']] = r['ISO_A2']
             # iso2t3[r['ISO_A2']] = r['ISO_A3']
 
-    lan_dist = {} #  {iso3: pid: dist}
-    with open(fpath_distance, "rt") as ft:
-        reader = csv.DictReader(ft)
-        for r in reader:
-            addr = r.pop('addr')
-            pid = r.pop('pid')
-            lon = r.pop('longitude')
-            lan = r.pop('latitude')
-            for k, v in r.items():
-                if k not in lan_dist:
-                    lan_dist[k] = {}
-                lan_dist[k][int(pid)] = v
+    # {iso3: [pid, ...]}: anchors with an edge in G, nearest to the country first
+    nearest = landmarks.nearest_anchor_ranking(fpath_distance, G, fpath_cache)
+
+    # {iso2: [pid, ...]}: anchors of the country with an edge in G
+    pools = landmarks.connected_pools(anchors_by_cnt, G)
 
-    init_anchors = {}  # {vp_ip: pid, ...}
     with open(fpath_vpconfig, "rt") as ft:
-        reader = csv.DictReader(ft)
-        for r in reader:
-            ip = r['ip']
-            cnt_iso3 = r['claimed_country_iso3']
-            cnt_iso2 = iso3t2[cnt_iso3]
-            if cnt_iso2 not in anchors_by_cnt:
-                sorted_lan_dist = sorted(lan_dist[cnt_iso3].items(), key=lambda x: x[1])
-                for pid, dm in sorted_lan_dist:
-                    edges = G.edges(pid, data=True)
-                    if len(edges) != 0:
-                        break
-                init_anchors[ip] = pid
-            else:
-                pid = random.choice(anchors_by_cnt[cnt_iso2])
-                init_anchors[ip] = pid
+        vps = [(r['ip'], r['claimed_country_iso3']) for r in csv.DictReader(ft)]
+    sampled = landmarks.sample_start_points([iso3t2[cnt_iso3] for ip, cnt_iso3 in vps], pools, seed)
+
+    init_anchors = {}  # {vp_ip: pid, ...}
+    for (ip, cnt_iso3), pid in zip(vps, sampled):
+        if pid is None:
+            # no connected anchor in the claimed country: the nearest one
+            if not nearest.get(cnt_iso3):
+                print(f"no connected anchor close to {cnt_iso3}: {ip}")
+                continue
+            pid = nearest[cnt_iso3][0]
+        init_anchors[ip] = pid
 
     return init_anchors
 
-def analyze_distance(anchors: list, landmarks: Landmark) -> dict:
+def analyze_distance(anchors: list, landmarks: Landmark, model: str = "vincenty",
+                     processes: int = 1, ckpt_dir: str = "../pickle/lm_dist_blocks") -> dict:
+    """
+    Args:
+        anchors: [pid, ...]
+        landmarks: {pid: (latitude, longitude)}
+        model: "vincenty" (WGS-84, within 1 mm of geopy), "haversine" (sphere, ~0.6%)
+               or "geodesic" (one geopy call per pair; slow)
+        processes: > 1 computes row blocks in a process pool, saving each
+                   finished block under ckpt_dir so a rerun resumes
+        ckpt_dir: directory for the block checkpoints
+
+    Returns:
+        {(pid_i, pid_j): km} for i < j in the order of anchors
+    """
     # calculate the shortest distance between two anchors
     lm_distances = {}
 
     no_exp = set()
-    for i in range(len(anchors)):
-        for j in range(i+1, len(anchors)):
-            fi_pid = anchors[i]
-            if fi_pid not in landmarks:
-                no_exp.add(fi_pid)
-                continue
-            fi_lon = landmarks[fi_pid][0]
-            fi_lat = landmarks[fi_pid][1]
-            se_pid = anchors[j]
-            if se_pid not in landmarks:
-                no_exp.add(se_pid)
-                continue
-            se_lon = landmarks[se_pid][0]
-            se_lat = landmarks[se_pid][1]
-            dist = GD((fi_lon, fi_lat), (se_lon, se_lat)).km
-            lm_distances[(fi_pid, se_pid)] = dist
-        print(f"** {i}/{len(anchors)} done")
+    if processes > 1:
+        no_exp = {pid for pid in anchors if pid not in landmarks}
+        pids = [pid for pid in anchors if pid in landmarks]
+        dist = geodist.pairwise_checkpointed([landmarks[pid][0] for pid in pids],
+                                             [landmarks[pid][1] for pid in pids],
+                                             ckpt_dir, model, processes)
+        lm_distances = geodist.to_pairs(pids, dist)
+    elif model == "geodesic":
+        for i in range(len(anchors)):
+            for j in range(i+1, len(anchors)):
+                fi_pid = anchors[i]
+                if fi_pid not in landmarks:
+                    no_exp.add(fi_pid)
+                    continue
+                fi_lon = landmarks[fi_pid][0]
+                fi_lat = landmarks[fi_pid][1]
+                se_pid = anchors[j]
+                if se_pid not in landmarks:
+                    no_exp.add(se_pid)
+                    continue
+                se_lon = landmarks[se_pid][0]
+                se_lat = landmarks[se_pid][1]
+                dist = GD((fi_lon, fi_lat), (se_lon, se_lat)).km
+                lm_distances[(fi_pid, se_pid)] = dist
+            print(f"** {i}/{len(anchors)} done")
+    else:
+        # all pairs in one vectorized pass over the condensed upper triangle
+        no_exp = {pid for pid in anchors if pid not in landmarks}
+        pids = [pid for pid in anchors if pid in landmarks]
+        dist = geodist.pairwise([landmarks[pid][0] for pid in pids],
+                                [landmarks[pid][1] for pid in pids], model)
+        lm_distances = geodist.to_pairs(pids, dist)
 
     print(no_exp)
     with open("../pickle/lm_dist.pickle", "wb") as fp:
         pickle.dump(lm_distances, fp)
+    # compact copy: condensed float32 array + pid index, memory-mapped by analyze_topo.py
+    geodist.DistanceStore.from_pairs(lm_distances).save("../pickle/lm_dist.npy")
 
     return lm_distances
 
@@ -250,7 +209,8 @@ def create_graph(lm_distances: dict):
         G.add_edge(fi_pid, se_pid, weight=dist)
     return G
 
-def _select_prim(G, weights, MAXG, max_strees, is_random100=False, is_feature=False, cname=None):
+def _select_prim(G, weights, MAXG, max_strees, is_random100=False, is_feature=False, cname=None, dense=None,
+                 lm_meta=None):
     """
     Args:
         G:
@@ -259,18 +219,17 @@ def _select_prim(G, weights, MAXG, max_strees, is_random100=False, is_feature=Fa
         max_strees:
         is_feature: True (prioritize unique cluster), False (don't care about cluster)
         cname:
+        dense: greedy.dense_graph(G) to use the vectorized engine (ignored with is_feature)
+        lm_meta: landmark metadata with is_feature, see load_feature_meta()
 
     Returns:
 
     """
-    if is_feature:
-        cluster = set()
-        geo_results = get_geo_results("../csv/final_result.csv")
-        abc = get_landmarks("../csv/anchorSelectionAll.csv", geo_results['anchors'])
-        lm_meta = get_landmarks_meta("../csv/anchorSelectionAll.csv", geo_results['anchors'])
-        ctotal = len(abc[cname].keys())
-
     start_index = 2
+    cluster_of = None
+    cluster = set()
+    if is_feature:
+        cluster_of = {pid: meta[cname] for pid, meta in lm_meta.items()}
     if is_random100:
         start_index = 101
 
@@ -278,49 +237,16 @@ def _select_prim(G, weights, MAXG, max_strees, is_random100=False, is_feature=Fa
             for pid in max_strees[100]:
                 cluster.add(lm_meta[pid][cname])
 
-    for k in range(start_index, G.number_of_nodes() + 1):
-        # find the maximum among these edges
-        if is_feature:
-            # sort by weight
-            if len(cluster) == ctotal:
-                selected_node = max(weights, key=weights.get)
-                removed_weight = weights.pop(selected_node)
-            else:
-                sorted_weight = sorted(weights.items(), key=lambda x: x[1], reverse=True)
-                selected_node = sorted_weight[0][0]
-                for pid, w in sorted_weight:
-                    # check if pid's cluster is unique
-                    if lm_meta[pid][cname] not in cluster:
-                        cluster.add(lm_meta[pid][cname])
-                        selected_node = pid
-                        # print(f"{pid} is selected!")
-                        break
-                removed_weight = weights.pop(selected_node)
-        else:
-            selected_node = max(weights, key=weights.get)
-            removed_weight = weights.pop(selected_node)
+    # heap-based greedy selection shared with analyze_topo.py
+    greedy.select_prim(G, weights, MAXG, max_strees, start_index, dense, cluster_of, cluster)
 
-        # add the chosen edge to the MST;
-        MAXG.add_node(selected_node)
-        # find edges connecting any vertex with the fringe vertices
-        for e in G.edges(selected_node, data=True):
-            current_nodes = {e[0], e[1]}
-            if len(current_nodes - set(MAXG.nodes())) == 0:
-                # remove duplication; we already have this edge in our selection
-                continue
-            current_nodes.remove(selected_node)
-            node = list(current_nodes)[0]
-            if node not in weights:
-                weights[node] = 0
-            weights[node] += e[2]['weight']
- 
-        # G.add_edge((selected_node, start), weight=rtt)
-        max_strees[k] = list(MAXG.nodes()).copy()
-
-        if len(weights) == 0:
-            break
- 
-def select_prim(G, option: str, store_fname: str, is_random100=False, is_feature=False, cname=None, start_point_vp={}):
+def load_feature_meta() -> dict:
+    """ Landmark metadata of the anchors of the geolocation experiment, for is_feature. """
+    geo_anchors = get_geo_results("../csv/final_result.csv", as_matrix=True).anchors.tolist()
+    return get_landmarks_meta("../csv/anchorSelectionAll.csv", geo_anchors)
+
+def select_prim(G, option: str, store_fname: str, is_random100=False, is_feature=False, cname=None, start_point_vp={},
+                dense=False, lm_meta=None, processes=1):
     """
     Args:
         G:
@@ -329,17 +255,23 @@ def select_prim(G, option: str, store_fname: str, is_random100=False, is_feature
         is_feature:
         cname:
         start_point_vp:
+        dense: True (vectorized engine on a float32 adjacency matrix), False (heap engine)
+        lm_meta: landmark metadata with is_feature (default: load_feature_meta(), read once per call)
+        processes: > 1 runs claimed_cnt over a process pool (heap engine), see greedy.select_parallel()
 
     Returns:
     """
-    max_strees = {}
+    max_strees = greedy.Selection()
     # select a starting node
     #        either (1) a node with maximum weight
     #            or (2) a node in the claimed country of the target
     print(f"start... {option}, {is_feature}, {cname}")
+    D = greedy.dense_graph(G) if dense else None
+    if is_feature and lm_meta is None:
+        lm_meta = load_feature_meta()
     if option == "max_edge":
         # initialize an empty set of selected nodes and an empty tree.
-        max_strees = {}  # {k value: [list of anchors]}
+        max_strees = greedy.Selection()  # {k value: [list of anchors]}
         MAXG = nx.Graph()
         max_edge = max(dict(G.edges).items(), key=lambda x: x[1]['weight'])
         starting_node = random.choice(max_edge[0])
@@ -352,17 +284,17 @@ def select_prim(G, option: str, store_fname: str, is_random100=False, is_feature
             node.remove(starting_node)
             weights[node[0]] = e[2]['weight']
 
-        _select_prim(G, weights, MAXG, max_strees, is_random100, is_feature, cname)
+        _select_prim(G, weights, MAXG, max_strees, is_random100, is_feature, cname, D, lm_meta)
 
         with open(store_fname, "wb") as f:
-            pickle.dump(max_strees, f)
+            pickle.dump(greedy.to_payload(max_strees), f)
         print(max_strees[10])
 
     elif option == "random":
-        max_strees = {}  # {k value: [list of anchors]}
+        max_strees = greedy.Selection()  # {k value: [list of anchors]}
         MAXG = nx.Graph()
-        geo_results = get_geo_results("csv/final_result.csv")
-        randomly_selected = random.sample(geo_results['anchors'], k=100)
+        geo_anchors = get_geo_results("csv/final_result.csv", as_matrix=True).anchors.tolist()
+        randomly_selected = random.sample(geo_anchors, k=100)
         for k, sn in enumerate(randomly_selected):
             MAXG.add_node(sn)
             # find edges connecting any vertex with the fringe vertices
@@ -373,34 +305,50 @@ def select_prim(G, option: str, store_fname: str, is_random100=False, is_feature
                 weights[node[0]] = e[2]['weight']
             max_strees[k+1] = list(MAXG.nodes()).copy()
 
-        _select_prim(G, weights, MAXG, max_strees, is_random100, is_feature, cname)
+        _select_prim(G, weights, MAXG, max_strees, is_random100, is_feature, cname, D, lm_meta)
 
         with open(store_fname, "wb") as f:
-            pickle.dump(max_strees, f)
+            pickle.dump(greedy.to_payload(max_strees), f)
         print(max_strees[10])
 
+    elif option == "claimed_cnt" and processes > 1 and not is_random100:
+        # one task per distinct start anchor; every finished VP is written as it arrives
+        cluster_of = {pid: meta[cname] for pid, meta in lm_meta.items()} if is_feature else None
+        greedy.select_parallel(G, start_point_vp, store_fname, processes, cluster_of,
+                               lambda done, total: print(f'{done}/{total}'))
+
     elif option == "claimed_cnt":
         all_mst = {}
-        count = 1
-        for vp_id, spid in start_point_vp.items():
-            print(f'{count}/{len(start_point_vp)}')
-            # initialize an empty set of selected nodes and an empty tree.
-            max_strees = {}  # {k value: [list of anchors]}
-            MAXG = nx.Graph()
-            MAXG.add_node(spid)
-            # find edges connecting any vertex with the fringe vertices
-            weights = {}  # {to_probe: total_weights_from_selected_nodes_to_the_probe}
-            for e in G.edges(spid, data=True):
-                node = list(e)
-                node.remove(spid)
-                weights[node[0]] = e[2]['weight']
-
-            _select_prim(G, weights, MAXG, max_strees, is_random100, is_feature, cname)
-            all_mst[vp_id] = max_strees.copy()
-            count += 1
+        if D is not None and not is_feature and not is_random100:
+            # advance all start points in lockstep, one score row per distinct start anchor
+            orders = greedy.batch_greedy(D, list(start_point_vp.values()))
+            for vp_id, spid in start_point_vp.items():
+                all_mst[vp_id] = greedy.prefixes(orders[spid])
+        else:
+            cached = {}  # {start anchor: max_strees}; VPs claiming the same country share a run
+            count = 1
+            for vp_id, spid in start_point_vp.items():
+                if spid in cached:
+                    all_mst[vp_id] = cached[spid]
+                    continue
+                print(f'{count}/{len(start_point_vp)}')
+                # initialize an empty set of selected nodes and an empty tree.
+                max_strees = greedy.Selection()  # {k value: [list of anchors]}
+                MAXG = nx.Graph()
+                MAXG.add_node(spid)
+                # find edges connecting any vertex with the fringe vertices
+                weights = {}  # {to_probe: total_weights_from_selected_nodes_to_the_probe}
+                for e in G.edges(spid, data=True):
+                    node = list(e)
+                    node.remove(spid)
+                    weights[node[0]] = e[2]['weight']
+
+                _select_prim(G, weights, MAXG, max_strees, is_random100, is_feature, cname, D, lm_meta)
+                all_mst[vp_id] = cached[spid] = max_strees
+                count += 1
 
         with open(store_fname, 'wb') as fp:
-            pickle.dump(all_mst, fp)
+            pickle.dump(greedy.to_payload(all_mst), fp)
     return max_strees
 
 
@@ -415,8 +363,14 @@ def main() -> None:
     active_anchors = load_anchors("../csv/final_result.csv")
     landmarks, anchors_by_cnt = load_landmarks("../csv/anchorSelectionAll.csv")
     # lm_distances = analyze_distance(active_anchors, landmarks)
-    with open("../pickle/lm_dist.pickle", "rb") as fp:
-        lm_distances = pickle.load(fp)
+    # graph weights keep the float64 distances of lm_dist.pickle; the float32
+    # lm_dist.npy is only a fallback when the pickle is not there
+    fpath = next((f for f in FPATH_LM_DISTANCE if os.path.exists(f)), FPATH_LM_DISTANCE[0])
+    if fpath.endswith(".pickle"):
+        with open(fpath, "rb") as fp:
+            lm_distances = pickle.load(fp)
+    else:
+        lm_distances = geodist.DistanceStore.load_any(fpath)
     G = create_graph(lm_distances)
 
     ## starting point for each vantage point
@@ -3,11 +3,19 @@
 
 ## This script is to run greedy algorithm for RTT
 
+import os
 import csv
+import json
 import time
 import random
 import pickle
+import numpy as np
 import networkx as nx
+
+import greedy
+import geodist
+import ping_table
+import landmarks
 # Type hints
 #
 from typing import (
@@ -26,8 +34,34 @@ from typing import (
     Tuple,
 )
 
-with open("pickle/lm_dist.pickle", "rb") as f:
-    LM_DISTANCE = pickle.load(f)
+# {(pid, pid): km} as a geodist.DistanceStore, loaded on first use by lm_distance()
+# the files below are created in "analyze_air.py"
+FPATH_LM_DISTANCE = ["pickle/lm_dist.npy", "pickle/lm_dist.pickle"]
+LM_DISTANCE = None
+SPEED_OF_LIGHT = geodist.SPEED_OF_LIGHT  # km/ms
+
+def lm_distance() -> geodist.DistanceStore:
+    global LM_DISTANCE
+    if LM_DISTANCE is None:
+        fpath = next((f for f in FPATH_LM_DISTANCE if os.path.exists(f)), FPATH_LM_DISTANCE[-1])
+        LM_DISTANCE = geodist.DistanceStore.load_any(fpath)
+    return LM_DISTANCE
+
+def set_lm_distance(lm_distances) -> None:
+    """ Swap the distance table, e.g. for another anchor set or in tests.
+    Args:
+        lm_distances: geodist.DistanceStore, {(pid, pid): km} or None (reload lazily)
+    """
+    global LM_DISTANCE
+    if isinstance(lm_distances, dict):
+        lm_distances = geodist.DistanceStore.from_pairs(lm_distances)
+    LM_DISTANCE = lm_distances
+
+def init_worker(spec: tuple) -> None:
+    """ mp.Pool initializer: attach to the table shared by
+    lm_distance().share() instead of loading a copy per worker.
+    """
+    set_lm_distance(geodist.DistanceStore.attach(spec))
 
 def load_anchors(fname: str) -> list:
     anchors = []
@@ -57,7 +91,17 @@ def load_landmarks(fname: str) -> (Landmark, dict):
 
     return rv, anchors_by_cnt
 
-def select_starting_anchor_for_vp(fpath_vpconfig: str, fpath_distance: str, anchors_by_cnt: dict, G) -> dict:
+def select_starting_anchor_for_vp(fpath_vpconfig: str, fpath_distance: str, anchors_by_cnt: dict, G,
+                                  fpath_cache: Optional[str] = None, seed: Optional[int] = None) -> dict:
+    """
+    Args:
+        fpath_vpconfig: VPN servers with their claimed country
+        fpath_distance: distance of every anchor to every country
+        anchors_by_cnt: {iso2: [pid, ...]}
+        G: anchor graph
+        fpath_cache: where the per-country ranking of anchors is kept, e.g. next to the graph file
+        seed: seed of the draw among the anchors of the claimed country (None: a different draw every run)
+    """
 
     iso3t2 = {}
     # iso2t3 = {}
@@ -67,76 +111,34 @@ def select_starting_anchor_for_vp(fpath_vpconfig: str, fpath_distance: str, anch
             iso3t2[r['ISO_A3']] = r['ISO_A2']
             # iso2t3[r['ISO_A2']] = r['ISO_A3']
 
-    lan_dist = {} #  {iso3: pid: dist}
-    # we'll have a dictionary to find anchor that is close to the claimed country
-    with open(fpath_distance, "rt") as ft:
-        reader = csv.DictReader(ft)
-        for r in reader:
-            addr = r.pop('addr')
-            pid = r.pop('pid')
-            lon = r.pop('longitude')
-            lan = r.pop('latitude')
-            for k, v in r.items():
-                if k not in lan_dist:
-                    lan_dist[k] = {}
-                lan_dist[k][int(pid)] = v
- 
-    init_anchors = {}  # {vp_ip: pid, ...}
+    # {iso3: [pid, ...]}: anchors with an edge in G, nearest to the country first
+    nearest = landmarks.nearest_anchor_ranking(fpath_distance, G, fpath_cache)
+
+    # {iso2: [pid, ...]}: anchors of the country with an edge in G
+    pools = landmarks.connected_pools(anchors_by_cnt, G)
+
     with open(fpath_vpconfig, "rt") as ft:
-        reader = csv.DictReader(ft)
-        for r in reader:
-            ip = r['ip']
-            cnt_iso3 = r['claimed_country_iso3']
-            cnt_iso2 = iso3t2[cnt_iso3]
-            if cnt_iso2 not in anchors_by_cnt:
-                # close_pid = min(lan_dist[cnt_iso3], key=lan_dist[cnt_iso3].get)
-                sorted_lan_dist = sorted(lan_dist[cnt_iso3].items(), key=lambda x: x[1])
-                for pid, dm in sorted_lan_dist:
-                    if G.has_node(pid):
-                        edges = G.edges(pid, data=True)
-                        if len(edges) != 0:
-                            break
-                    else:
-                        print(pid, dm)
-                init_anchors[ip] = pid
-            else:
-                count = 0
-                while True:
-                    count += 1
-                    print(ip, "inside while")
-                    pid = random.choice(anchors_by_cnt[cnt_iso2])
-                    if G.has_node(pid):
-                        edges = G.edges(pid, data=True)
-                        if len(edges) != 0:
-                            break
-
-                    if count == 10:
-                        sorted_lan_dist = sorted(lan_dist[cnt_iso3].items(), key=lambda x: x[1])
-                        for pid, dm in sorted_lan_dist:
-                            if G.has_node(pid):
-                                edges = G.edges(pid, data=True)
-                                if len(edges) != 0:
-                                    break
-                            else:
-                                print(pid, dm)
-                        break
-                init_anchors[ip] = pid
+        vps = [(r['ip'], r['claimed_country_iso3']) for r in csv.DictReader(ft)]
+    sampled = landmarks.sample_start_points([iso3t2[cnt_iso3] for ip, cnt_iso3 in vps], pools, seed)
+
+    init_anchors = {}  # {vp_ip: pid, ...}
+    for (ip, cnt_iso3), pid in zip(vps, sampled):
+        if pid is None:
+            # no connected anchor in the claimed country: the nearest one
+            if not nearest.get(cnt_iso3):
+                print(f"no connected anchor close to {cnt_iso3}: {ip}")
+                continue
+            pid = nearest[cnt_iso3][0]
+        init_anchors[ip] = pid
 
     return init_anchors
 
 def remove_rtt_faster_than_speed_of_light(all_rtts, org_prb_id, target_prb_id):
-    # the file below is created in "analyze_air.py"
-    # with open("pickle/lm_dist.pickle", "rb") as f:
-    #     lm_distance = pickle.load(f)
-    global LM_DISTANCE
-    if (org_prb_id, target_prb_id) in LM_DISTANCE:
-        dist = LM_DISTANCE[(org_prb_id, target_prb_id)]
-    elif (target_prb_id, org_prb_id) in LM_DISTANCE:
-        dist = LM_DISTANCE[(target_prb_id, org_prb_id)]
-    else:
+    dist = lm_distance().get(org_prb_id, target_prb_id)
+    if dist is None:
         return all_rtts
 
-    s = 299.792  # km/ms
+    s = SPEED_OF_LIGHT
 
     all_rtts = list(set(all_rtts))
     temp2 = all_rtts.copy()
@@ -148,7 +150,222 @@ def remove_rtt_faster_than_speed_of_light(all_rtts, org_prb_id, target_prb_id):
     all_rtts = temp2.copy()
     return all_rtts
 
-def create_graph(anchors, fpath_pings, fpath_graph):
+def flatten_pings(meas_pings: dict) -> (list, dict):
+    """ Flatten mesh pings into parallel arrays, one entry per RTT sample.
+    Args:
+        meas_pings: {(target_prd_id, msm_id, meas_start_time): {org_prb_id: [(timestamp, minimum_rtt)]}}
+
+    Returns:
+        groups: [(key, org_prb_id)], one per (measurement, origin) list
+        samples: {'group': int64, 'origin': int64, 'target': int64, 'rtt': float64}
+    """
+    groups = []
+    group = []
+    rtt = []
+    for key, origins in meas_pings.items():
+        for org_prb_id, all_meas in origins.items():
+            group.extend([len(groups)] * len(all_meas))
+            rtt.extend(m[1] for m in all_meas)
+            groups.append((key, org_prb_id))
+    group = np.array(group, dtype=np.int64)
+    origin = np.array([g[1] for g in groups], dtype=np.int64)
+    target = np.array([g[0][0] for g in groups], dtype=np.int64)
+    return groups, {'group': group, 'origin': origin[group], 'target': target[group],
+                    'rtt': np.array(rtt, dtype=np.float64)}
+
+def filter_rtt_batch(origin, target, rtt, store=None) -> (np.ndarray, dict):
+    """ Vectorized remove_rtt_faster_than_speed_of_light over many samples.
+    A sample is dropped if it is not positive or if the one-way time would
+    beat the speed of light over the anchors' distance; pairs with no known
+    distance are only checked for positive RTTs.
+    Args:
+        origin: origin probe id per sample
+        target: target probe id per sample
+        rtt: RTT (ms) per sample
+        store: geodist.DistanceStore (default: lm_distance())
+
+    Returns:
+        keep: bool mask over the samples
+        stats: {'kept': int, 'removed': int,
+                'removed_by_origin': {pid: count}, 'removed_by_target': {pid: count}}
+    """
+    store = lm_distance() if store is None else store
+    rtt = np.asarray(rtt, dtype=np.float64)
+    dist = store.lookup(origin, target).astype(np.float64)
+    positive = rtt > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        too_fast = positive & (dist / (rtt / 2) > SPEED_OF_LIGHT)
+    keep = positive & ~too_fast
+
+    stats = {'kept': int(keep.sum()), 'removed': int(too_fast.sum())}
+    for end, pids in (('origin', origin), ('target', target)):
+        pid, count = np.unique(np.asarray(pids)[too_fast], return_counts=True)
+        stats['removed_by_' + end] = dict(zip(pid.tolist(), count.tolist()))
+    return keep, stats
+
+def _min_by_pair(src, dst, rtt, n):
+    """ Minimum rtt per (src, dst) row pair, in order of first occurrence. """
+    key = src.astype(np.int64) * n + dst
+    order = np.argsort(key, kind="stable")
+    starts = np.flatnonzero(np.r_[True, np.diff(key[order]) != 0]) if len(key) else np.zeros(0, dtype=np.int64)
+    rtt_min = np.minimum.reduceat(rtt[order], starts) if len(key) else rtt[:0]
+    first = order[starts]
+    by_first = np.argsort(first)
+    return src[first][by_first], dst[first][by_first], rtt_min[by_first]
+
+class EdgeTable(NamedTuple):
+    """ RTT topology as parallel arrays instead of networkx graphs. """
+    pids: np.ndarray  # int64 [n], anchor at row i (in the order anchors were first seen)
+    src: np.ndarray  # int64 [m], row of the origin anchor
+    dst: np.ndarray  # int64 [m], row of the target anchor
+    rtt: np.ndarray  # float64 [m], minimum rtt (ms)
+
+    @classmethod
+    def directed(cls, pids, src, dst, rtt) -> "EdgeTable":
+        """ One edge per directed pair holding the minimum over all samples. """
+        src, dst, rtt = _min_by_pair(np.asarray(src), np.asarray(dst), np.asarray(rtt, dtype=np.float64), len(pids))
+        return cls(np.asarray(pids, dtype=np.int64), src, dst, rtt)
+
+    def undirected(self) -> "EdgeTable":
+        """ Min over both orientations of every anchor pair. """
+        lo = np.minimum(self.src, self.dst)
+        hi = np.maximum(self.src, self.dst)
+        return EdgeTable.directed(self.pids, lo, hi, self.rtt)
+
+    def to_networkx(self):
+        G = nx.Graph()
+        G.add_nodes_from(self.pids.tolist())
+        G.add_weighted_edges_from(zip(self.pids[self.src].tolist(), self.pids[self.dst].tolist(), self.rtt.tolist()))
+        return G
+
+    def save(self, fpath: str) -> None:
+        with open(fpath, "wb") as f:
+            np.savez_compressed(f, pids=self.pids, src=self.src, dst=self.dst, rtt=self.rtt)
+
+    @classmethod
+    def load(cls, fpath: str) -> "EdgeTable":
+        with np.load(fpath) as d:
+            return cls(d['pids'], d['src'], d['dst'], d['rtt'])
+
+def load_graph(fpath_graph: str):
+    """ networkx graph from a create_graph() output, pickled graph or EdgeTable (.npz). """
+    if fpath_graph.endswith(".npz"):
+        return EdgeTable.load(fpath_graph).to_networkx()
+    with open(fpath_graph, "rb") as f:
+        return pickle.load(f)
+
+def iter_jsonl_batches(fpath: str, batch_size: int = 100000) -> Iterator[tuple]:
+    """ Read mesh pings written line by line by retrieve_topo.py, a few
+    samples at a time.
+    Each line: {"target": pid, "msm_id": int, "start": str, "origin": pid, "pings": [[timestamp, minimum_rtt], ...]}
+    Returns:
+        iterator over (origin, target, rtt) arrays of about batch_size samples
+    """
+    origin, target, rtt = [], [], []
+    with open(fpath, "rt") as f:
+        for line in f:
+            rec = json.loads(line)
+            n = len(rec['pings'])
+            origin.extend([rec['origin']] * n)
+            target.extend([rec['target']] * n)
+            rtt.extend(p[1] for p in rec['pings'])
+            if len(rtt) >= batch_size:
+                yield np.array(origin, dtype=np.int64), np.array(target, dtype=np.int64), np.array(rtt, dtype=np.float64)
+                origin, target, rtt = [], [], []
+    if rtt:
+        yield np.array(origin, dtype=np.int64), np.array(target, dtype=np.int64), np.array(rtt, dtype=np.float64)
+
+def iter_column_batches(fpath: str, time_range: Optional[Tuple[int, int]] = None,
+                        anchors: Optional[Sequence[int]] = None) -> Iterator[tuple]:
+    """ (origin, target, rtt) arrays of a ping_table directory, one chunk at a time,
+    optionally restricted to a (start, stop) unix time range and to pings between `anchors`.
+    """
+    start, stop = time_range if time_range is not None else (None, None)
+    for cols in ping_table.read(fpath, start, stop, anchors, columns=("origin", "target", "min_rtt")):
+        yield cols['origin'].astype(np.int64), cols['target'].astype(np.int64), cols['min_rtt']
+
+class MinRttReducer:
+    """ Running minimum RTT per directed (origin, target) anchor pair.
+
+    Samples are fed in batches, filtered with filter_rtt_batch() and folded
+    into an n x n array indexed by anchor row, so memory grows with the
+    number of anchor pairs rather than the number of samples.
+    """
+
+    def __init__(self, capacity: int = 1024, store=None) -> None:
+        self.store = store
+        self.index = {}  # {pid: row}
+        self.pids = []  # [pid at row]
+        self.rtt_min = np.full((capacity, capacity), np.inf)
+        self.kept = 0
+        self.removed = 0
+
+    def rows(self, pids) -> np.ndarray:
+        uniq, inv = np.unique(pids, return_inverse=True)
+        for pid in uniq.tolist():
+            if pid not in self.index:
+                self.index[pid] = len(self.pids)
+                self.pids.append(pid)
+        if len(self.pids) > len(self.rtt_min):
+            grown = np.full((2 * len(self.pids),) * 2, np.inf)
+            grown[:len(self.rtt_min), :len(self.rtt_min)] = self.rtt_min
+            self.rtt_min = grown
+        return np.array([self.index[pid] for pid in uniq.tolist()], dtype=np.int64)[inv]
+
+    def add(self, origin, target, rtt) -> None:
+        keep, stats = filter_rtt_batch(origin, target, rtt, self.store)
+        self.kept += stats['kept']
+        self.removed += stats['removed']
+        o = self.rows(origin)
+        t = self.rows(target)
+        np.minimum.at(self.rtt_min, (o[keep], t[keep]), np.asarray(rtt, dtype=np.float64)[keep])
+
+    def edge_table(self) -> EdgeTable:
+        """ Undirected EdgeTable of every anchor seen, min RTT over both directions. """
+        n = len(self.pids)
+        src, dst = np.nonzero(np.isfinite(self.rtt_min[:n, :n]))
+        return EdgeTable.directed(self.pids, src, dst, self.rtt_min[src, dst]).undirected()
+
+    def to_graph(self):
+        return self.edge_table().to_networkx()
+
+def create_graph_streaming(batches, fpath_graph, as_table=False):
+    """ create_graph() over (origin, target, rtt) batches, e.g. iter_jsonl_batches(). """
+    reducer = MinRttReducer()
+    for origin, target, rtt in batches:
+        reducer.add(origin, target, rtt)
+    print(f"rtts kept: {reducer.kept}, rtts faster than speed of light: {reducer.removed}")
+    table = reducer.edge_table()
+    if as_table:
+        table.save(fpath_graph)
+        return table
+    G = table.to_networkx()
+    pickle.dump(G, open(fpath_graph, 'wb'))
+    return G
+
+def create_graph(anchors, fpath_pings, fpath_graph, batch=True, as_table=False, time_range=None, subset=None):
+    """
+    Args:
+        anchors:
+        fpath_pings: mesh_pings pickle (or .jsonl, or ping_table .columns directory) written by retrieve_topo.py
+        fpath_graph: where the undirected min-RTT graph is stored, see load_graph()
+        batch: True (vectorized speed-of-light filter), False (per-list filter)
+        as_table: True (store an EdgeTable as .npz), False (pickle a networkx graph)
+        time_range: .columns only, (start, stop) unix timestamps of the pings to use
+        subset: .columns only, anchors whose pings between each other are used
+    """
+    if fpath_pings.rstrip("/").endswith(ping_table.SUFFIX):
+        # columnar pings are read chunk by chunk, skipping chunks outside of the filters
+        print(f"Reading columns... {fpath_pings}")
+        create_graph_streaming(iter_column_batches(fpath_pings, time_range, subset), fpath_graph, as_table)
+        return
+
+    if fpath_pings.endswith(".jsonl"):
+        # line-delimited pings are reduced on the fly instead of being loaded at once
+        print(f"Streaming... {fpath_pings}")
+        create_graph_streaming(iter_jsonl_batches(fpath_pings), fpath_graph, as_table)
+        return
+
     print(f"Reading... {fpath_pings}")
     with open(fpath_pings, "rb") as f:
         meas_pings = pickle.load(f)
@@ -159,36 +376,66 @@ def create_graph(anchors, fpath_pings, fpath_graph):
     _count_removed = 0
     _count_kept = 0
     _anchors_with_no_rtt = set()
-    for key in meas_pings:
-        meas_pings_min[key] = {}
-        for org_prb_id, all_meas in meas_pings[key].items():
-            all_rtt = [i[1] for i in all_meas if i[1] > 0]
-            # remove all rtts that are faster than speed of light
-            all_rtt = remove_rtt_faster_than_speed_of_light(all_rtt, org_prb_id, key[0])
-            if len(all_rtt) != 0:
-                meas_pings_min[key][org_prb_id] = min(all_rtt)
+    if batch:
+        groups, samples = flatten_pings(meas_pings)
+        keep, stats = filter_rtt_batch(samples['origin'], samples['target'], samples['rtt'])
+        print(f"rtts kept: {stats['kept']}, rtts faster than speed of light: {stats['removed']}")
+        # minimum rtt per (measurement, origin); inf where nothing is left
+        rtt_min = np.full(len(groups), np.inf)
+        np.minimum.at(rtt_min, samples['group'][keep], samples['rtt'][keep])
+        for key in meas_pings:
+            meas_pings_min[key] = {}
+        for (key, org_prb_id), rtt in zip(groups, rtt_min.tolist()):
+            if rtt != np.inf:
+                meas_pings_min[key][org_prb_id] = rtt
                 _count_kept += 1
             else:
                 meas_pings_min[key][org_prb_id] = -1
                 _count_removed += 1
                 _anchors_with_no_rtt.add(key[0])
+    else:
+        for key in meas_pings:
+            meas_pings_min[key] = {}
+            for org_prb_id, all_meas in meas_pings[key].items():
+                all_rtt = [i[1] for i in all_meas if i[1] > 0]
+                # remove all rtts that are faster than speed of light
+                all_rtt = remove_rtt_faster_than_speed_of_light(all_rtt, org_prb_id, key[0])
+                if len(all_rtt) != 0:
+                    meas_pings_min[key][org_prb_id] = min(all_rtt)
+                    _count_kept += 1
+                else:
+                    meas_pings_min[key][org_prb_id] = -1
+                    _count_removed += 1
+                    _anchors_with_no_rtt.add(key[0])
 
     print(f"count_kept: {_count_kept}, count_removed: {_count_removed}")
     print(f"anchors removed (no rtt left): {_anchors_with_no_rtt}")
 
+    if batch or as_table:
+        # anchors in the order the graph loop below adds them, edges (origin -> target) with an rtt left
+        pids = list(dict.fromkeys(pid for (target_prb_id, msm_id, start_date), origins in meas_pings_min.items()
+                                  for pid in [target_prb_id, *origins]))
+        row = {pid: i for i, pid in enumerate(pids)}
+        edges = [(row[origin_prb_id], row[key[0]], rtt) for key, origins in meas_pings_min.items()
+                 for origin_prb_id, rtt in origins.items() if rtt != -1]
+        src, dst, rtt = (np.array(x) for x in zip(*edges)) if edges else (np.zeros(0, dtype=np.int64),) * 3
+        table = EdgeTable.directed(pids, src, dst, rtt).undirected()
+        if as_table:
+            table.save(fpath_graph)
+        else:
+            pickle.dump(table.to_networkx(), open(fpath_graph, 'wb'))
+        return
+
     # create an empty graph: start creating
     G = nx.Graph()
-    DG = nx.DiGraph()
 
     for (target_prb_id, msm_id, start_date), origins in meas_pings_min.items():
         assert (type(target_prb_id) == int) and (type(list(origins.keys())[0]))
 
         G.add_node(target_prb_id)
-        DG.add_node(target_prb_id)
 
         for origin_prb_id, rtt in origins.items():
             G.add_node(origin_prb_id)
-            DG.add_node(origin_prb_id)
 
             # Let's give a range for reasonable RTT values
             if rtt == -1:
@@ -200,48 +447,23 @@ def create_graph(anchors, fpath_pings, fpath_graph):
                 if rtt < G.edges[origin_prb_id, target_prb_id]['weight']:
                     G.edges[origin_prb_id, target_prb_id]['weight'] = rtt
 
-            if not DG.has_edge(*edge):
-                DG.add_edge(*edge, weight=rtt)
-            else:
-                if rtt < DG[origin_prb_id][target_prb_id]['weight']:
-                    DG[origin_prb_id][target_prb_id]['weight'] = rtt
-
     pickle.dump(G, open(fpath_graph, 'wb'))
 
 
-def _select_prim(G, weights, MAXG, max_strees):
-    for k in range(2, G.number_of_nodes() + 1):
-        # find the maximum among these edges
-        selected_node = max(weights, key=weights.get)
-        removed_weight = weights.pop(selected_node)
+def _select_prim(G, weights, MAXG, max_strees, dense=None):
+    # heap-based (or dense matrix) greedy selection shared with analyze_air.py
+    greedy.select_prim(G, weights, MAXG, max_strees, dense=dense)
 
-        # add the chosen edge to the MST;
-        MAXG.add_node(selected_node)
-        # step2: find edges connecting any vertex with the fringe vertices
-        for e in G.edges(selected_node, data=True):
-            current_nodes = {e[0], e[1]}
-            if len(current_nodes - set(MAXG.nodes())) == 0:
-                # remove duplication; we already have this edge in our selection
-                continue
-            current_nodes.remove(selected_node)
-            node = list(current_nodes)[0]
-            if node not in weights:
-                weights[node] = 0
-            weights[node] += e[2]['weight']
-
-        # add the chosen edge to the MST;
-        max_strees[k] = list(MAXG.nodes()).copy()
-
-        if len(weights) == 0:
-            break
-
-def select_prim(G, option: str, fpath, start_point_vp={}):
+def select_prim(G, option: str, fpath, start_point_vp={}, dense=False, processes=1):
     print(f"start prim: {option}, {fpath}")
+    # dense: run the vectorized engine on a float32 adjacency matrix built once
+    # processes: > 1 runs claimed_cnt over a process pool (heap engine), see greedy.select_parallel()
+    D = greedy.dense_graph(G) if dense else None
     #  select a starting node
     #        either (1) a node with maximum weight
     #            or (2) a node in the claimed country of the target
     if option == "max_edge":
-        max_strees = {} # {k value: [list of anchors]}
+        max_strees = greedy.Selection()  # {k value: [list of anchors]}
         #  initialize an empty set of selected nodes and an empty tree.
         MAXG = nx.Graph()
         max_edge = max(dict(G.edges).items(), key=lambda x: x[1]['weight'])
@@ -255,36 +477,50 @@ def select_prim(G, option: str, fpath, start_point_vp={}):
             node.remove(starting_node)
             weights[node[0]] = e[2]['weight']
 
-        _select_prim(G, weights, MAXG, max_strees)
+        _select_prim(G, weights, MAXG, max_strees, D)
 
         with open(fpath, "wb") as f:
-            pickle.dump(max_strees, f)
+            pickle.dump(greedy.to_payload(max_strees), f)
+
+    elif option == "claimed_cnt" and processes > 1:
+        print("start ... claimed_cnt")
+        # one task per distinct start anchor; every finished VP is written as it arrives
+        greedy.select_parallel(G, start_point_vp, fpath, processes,
+                               progress=lambda done, total: print(f'{done}/{total}'))
 
     elif option == "claimed_cnt":
         print("start ... claimed_cnt")
         all_mst = {}
-        count = 1
-        for vp_id, spid in start_point_vp.items():
-            print(f'{count}/{len(start_point_vp)}')
-            # initialize an empty set of selected nodes and an empty tree.
-            max_strees = {}  # {k value: [list of anchors]}
-            MAXG = nx.Graph()
-            MAXG.add_node(spid)
-            # find edges connecting any vertex with the fringe vertices
-            weights = {}  # {to_probe: total_weights_from_selected_nodes_to_the_probe}
-            print(vp_id, spid)
-            for e in G.edges(spid, data=True):
-                node = list(e)
-                node.remove(spid)
-                weights[node[0]] = e[2]['weight']
-
-            _select_prim(G, weights, MAXG, max_strees)
-            all_mst[vp_id] = max_strees.copy()
-            count += 1
-            print(all_mst[vp_id])
+        if D is not None:
+            # advance all start points in lockstep, one score row per distinct start anchor
+            orders = greedy.batch_greedy(D, list(start_point_vp.values()))
+            for vp_id, spid in start_point_vp.items():
+                all_mst[vp_id] = greedy.prefixes(orders[spid])
+        else:
+            cached = {}  # {start anchor: max_strees}; VPs claiming the same country share a run
+            count = 1
+            for vp_id, spid in start_point_vp.items():
+                if spid in cached:
+                    all_mst[vp_id] = cached[spid]
+                    continue
+                print(f'{count}/{len(start_point_vp)}: {vp_id}, {spid}')
+                # initialize an empty set of selected nodes and an empty tree.
+                max_strees = greedy.Selection()  # {k value: [list of anchors]}
+                MAXG = nx.Graph()
+                MAXG.add_node(spid)
+                # find edges connecting any vertex with the fringe vertices
+                weights = {}  # {to_probe: total_weights_from_selected_nodes_to_the_probe}
+                for e in G.edges(spid, data=True):
+                    node = list(e)
+                    node.remove(spid)
+                    weights[node[0]] = e[2]['weight']
+
+                _select_prim(G, weights, MAXG, max_strees)
+                all_mst[vp_id] = cached[spid] = max_strees
+                count += 1
 
         with open(fpath, 'wb') as fp:
-            pickle.dump(all_mst, fp)
+            pickle.dump(greedy.to_payload(all_mst), fp)
 
 
 def main() -> None:
@@ -299,12 +535,12 @@ def main() -> None:
     fpath_graph = 'pickle/ugraph_meas_1h_12-08.pickle'
     create_graph(active_anchors, fpath_meas, fpath_graph)
 
-    G = pickle.load(open(fpath_graph, 'rb'))
+    G = load_graph(fpath_graph)
 
     # [diff starting point]
     start_point_vp = {} # this is for the option starting from the claimed country
     start_point_vp = select_starting_anchor_for_vp('csv/vpn_configs.csv', 'csv/landmarks-and-distances_pid.csv',
-                                                   anchors_by_cnt, G)
+                                                   anchors_by_cnt, G, fpath_graph + ".nearest.pickle", seed=0)
     # select_prim(G, 'claimed_cnt', ""pickle/selected_nodes_only_rtt_starting_from_claimed_cnt.pickle"", start_point_vp)
     # select_prim(G, 'max_edge', "pickle/selected_nodes_only_rtt.pickle", start_point_vp)
     # select_prim(G, 'max_edge', "pickle/selected_nodes_only_owtt_removed.pickle", start_point_vp)
@@ -0,0 +1,110 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# In-memory directory of all RIPE Atlas anchors, indexed by hostname and IP.
+# One paginated listing replaces the per-measurement
+# /api/v2/anchors/?search=<target> requests of retrieve_topo.py.
+
+import csv
+import time
+import threading
+
+from ripe.atlas.cousteau import (
+  AtlasRequest,
+  AnchorRequest,
+)
+
+from typing import (
+    Iterator,
+    List,
+    Optional,
+)
+
+CSV_FIELDS = ['addr', 'aid', 'pid', 'longitude', 'latitude', 'city', 'country', 'anchors p', 'probes p', 'asn']
+
+
+class AnchorDirectory:
+    """
+    Args:
+        client: atlas_client.AtlasClient, or None to use ripe.atlas.cousteau
+        max_age: seconds after which refresh() lists all anchors again
+    """
+
+    def __init__(self, client=None, max_age: float = 24 * 3600) -> None:
+        self.client = client
+        self.max_age = max_age
+        self.anchors = {}  # {anchor id: anchor object of the API}
+        self.by_host = {}  # {fqdn / ipv4 / ipv6: anchor object}
+        self.fetched_at = 0.0
+        self.searches = 0  # lookups that fell back to a search request
+        self.lock = threading.Lock()
+
+    def _add(self, anchor: dict) -> None:
+        self.anchors[anchor['id']] = anchor
+        for host in (anchor.get('fqdn'), anchor.get('ip_v4'), anchor.get('ip_v6')):
+            if host:
+                self.by_host[host.lower()] = anchor
+
+    def _list(self) -> Iterator[dict]:
+        if self.client is not None:
+            return self.client.iter_pages("/api/v2/anchors/", {"page_size": 500})
+        return iter(AnchorRequest())
+
+    def refresh(self, force: bool = False) -> None:
+        """ List all anchors, unless the directory is younger than max_age. """
+        if not force and time.time() - self.fetched_at < self.max_age:
+            return
+        anchors = list(self._list())
+        with self.lock:
+            for anchor in anchors:
+                self._add(anchor)
+            self.fetched_at = time.time()
+        print(f"anchor directory: {len(self.anchors)} anchors")
+
+    def _search(self, target: str) -> Optional[dict]:
+        url_path = "/api/v2/anchors/?search=" + target
+        if self.client is not None:
+            (is_success, response) = self.client.get_json(url_path)
+        else:
+            (is_success, response) = AtlasRequest(**{"url_path": url_path}).get()
+        if not is_success or not response.get('results'):
+            print(f"fail to get anchor info: {url_path}")
+            return None
+        return response['results'][0]
+
+    def lookup(self, target: str) -> Optional[dict]:
+        """ Anchor object for a hostname or IP. Targets missing from the
+        listing (e.g. anchors added since) are searched once and added.
+        """
+        anchor = self.by_host.get(target.lower())
+        if anchor is not None:
+            return anchor
+        anchor = self._search(target)
+        with self.lock:
+            self.searches += 1
+            if anchor is not None:
+                self._add(anchor)
+                self.by_host[target.lower()] = anchor
+        return anchor
+
+    def probe_ids(self) -> List[int]:
+        return [anchor['probe'] for anchor in self.anchors.values()]
+
+    def to_csv(self, fpath: str) -> None:
+        """ Write the active IPv4 anchors in the layout of csv/anchorSelectionAll.csv
+        (the 'anchors p' and 'probes p' columns are left empty).
+        """
+        with open(fpath, "wt", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            for anchor in sorted(self.anchors.values(), key=lambda a: (a.get('country') or '', a['id'])):
+                if anchor.get('is_disabled') or not anchor.get('geometry'):
+                    continue
+                if not anchor.get('ip_v4') or not anchor.get('as_v4'):
+                    # IPv6-only: not in the IPv4 mesh, and 'asn' must be an integer
+                    continue
+                longitude, latitude = anchor['geometry']['coordinates']
+                writer.writerow({'addr': anchor.get('ip_v4'), 'aid': anchor['id'], 'pid': anchor['probe'],
+                                 'longitude': longitude, 'latitude': latitude, 'city': anchor.get('city'),
+                                 'country': anchor.get('country'), 'anchors p': '', 'probes p': '',
+                                 'asn': anchor.get('as_v4')})
@@ -0,0 +1,190 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Minimal thread-safe client for the RIPE Atlas REST API, used for concurrent
+# retrieval. Unlike ripe.atlas.cousteau (which always talks https to
+# atlas.ripe.net) the base url is configurable, so it can be pointed at a
+# local stub server.
+
+import json
+import time
+import random
+import calendar
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit, urljoin
+
+import requests
+
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    Optional,
+    Tuple,
+)
+
+ATLAS_URL = "https://atlas.ripe.net"
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def timestamp(t) -> int:
+    """ Unix timestamp for the API; naive datetimes are taken as UTC, like cousteau does. """
+    if isinstance(t, datetime):
+        return calendar.timegm(t.timetuple())
+    return int(t)
+
+
+def iter_json_array(chunks: Iterator[str]) -> Iterator[Any]:
+    """ Objects of a JSON array of objects, decoded while the text arrives in chunks. """
+    decoder = json.JSONDecoder()
+    buf = ""
+    started = False
+    for chunk in chunks:
+        buf += chunk
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos == len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"not a JSON array: {buf[pos:pos + 80]}")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                return
+            try:
+                obj, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # incomplete object: wait for the next chunk
+            yield obj
+        buf = buf[pos:]
+    raise ValueError("truncated JSON array")
+
+
+class RateLimiter:
+    """ Token bucket per host: at most `rate` requests per second, bursts up to `burst`. """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.lock = threading.Lock()
+        self.buckets = {}  # {host: (tokens, last refill time)}
+
+    def acquire(self, host: str) -> None:
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                tokens, last = self.buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - last) * self.rate)
+                if tokens >= 1:
+                    self.buckets[host] = (tokens - 1, now)
+                    return
+                self.buckets[host] = (tokens, now)
+                wait = (1 - tokens) / self.rate
+            time.sleep(wait)
+
+    def slow_down(self, host: str, seconds: float) -> None:
+        """ Drain the bucket of `host` for `seconds`, e.g. on a 429 with Retry-After. """
+        with self.lock:
+            self.buckets[host] = (-seconds * self.rate, time.monotonic())
+
+
+class AtlasClient:
+    """
+    Args:
+        base_url: API server, e.g. "http://127.0.0.1:8080" for a stub
+        rate: requests per second per host (0: unlimited)
+        retries: attempts after the first one on connection errors, 429 and 5xx
+        backoff: first retry delay in seconds, doubled on every retry (with jitter)
+        timeout: per request timeout in seconds
+        key: optional API key
+    """
+
+    def __init__(self, base_url: str = ATLAS_URL, rate: float = 10.0, retries: int = 5,
+                 backoff: float = 1.0, timeout: float = 60.0, key: Optional[str] = None) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.limiter = RateLimiter(rate, burst=max(1, int(rate)))
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.key = key
+        self.local = threading.local()  # one requests.Session per thread
+
+    @property
+    def session(self) -> requests.Session:
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+            self.local.session.headers.update({"Accept": "application/json"})
+            if self.key:
+                self.local.session.headers.update({"Authorization": f"Key {self.key}"})
+        return self.local.session
+
+    def url(self, path: str) -> str:
+        return path if "://" in path else urljoin(self.base_url + "/", path.lstrip("/"))
+
+    def request(self, method: str, path: str, stream: bool = False, **kwargs) -> Tuple[bool, Any]:
+        """ Rate-limited request with retries.
+        Returns:
+            (is_success, response): the requests.Response, or the last error
+        """
+        url = self.url(path)
+        host = urlsplit(url).netloc
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                time.sleep(delay + random.uniform(0, delay / 2))
+            self.limiter.acquire(host)
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, stream=stream, **kwargs)
+            except requests.RequestException as e:
+                error = e
+                continue
+            if response.status_code in RETRY_STATUS:
+                retry_after = response.headers.get("Retry-After")
+                if retry_after and retry_after.isdigit():
+                    self.limiter.slow_down(host, float(retry_after))
+                error = response
+                response.close()
+                continue
+            return response.ok, response
+        return False, error
+
+    def get_json(self, path: str, params: Optional[Dict[str, Any]] = None) -> Tuple[bool, Any]:
+        is_success, response = self.request("GET", path, params=params)
+        if not is_success:
+            return False, response
+        return True, response.json()
+
+    def iter_json(self, path: str, params: Optional[Dict[str, Any]] = None,
+                  chunk_size: int = 1 << 16) -> Tuple[bool, Any]:
+        """ Like get_json() for a JSON array, but the objects are parsed one by
+        one while the response is downloaded instead of holding all of it.
+        Returns:
+            (is_success, iterator over the objects), or (False, error)
+        """
+        is_success, response = self.request("GET", path, stream=True, params=params)
+        if not is_success:
+            return False, response
+        response.encoding = response.encoding or "utf-8"
+
+        def objects() -> Iterator[Any]:
+            with response:
+                yield from iter_json_array(response.iter_content(chunk_size, decode_unicode=True))
+        return True, objects()
+
+    def iter_pages(self, path: str, params: Optional[Dict[str, Any]] = None) -> Iterator[dict]:
+        """ Objects of a paginated listing, following the "next" links. """
+        is_success, page = self.get_json(path, params)
+        while is_success:
+            yield from page.get("results", [])
+            if not page.get("next"):
+                return
+            is_success, page = self.get_json(page["next"])
+        raise IOError(f"fail to get {path}: {page}")
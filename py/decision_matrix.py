@@ -0,0 +1,129 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+## VPN x anchor geolocation decisions of final_result.csv as an int8 matrix.
+## Header: VPN_IP, <prb_id> ..., final; every cell is "True", "False" or an unknown marker.
+## Codes: 1 (True), 0 (False), negative for each distinct unknown marker.
+
+import os
+import csv
+import hashlib
+
+import numpy as np
+
+from typing import (
+    Dict,
+    NamedTuple,
+    Optional,
+)
+
+TRUE = 1
+FALSE = 0
+CACHE_VERSION = 1
+
+
+class DecisionMatrix(NamedTuple):
+    vpns: np.ndarray  # str [n], VPN_IP of row i
+    anchors: np.ndarray  # int64 [m], prb_id of column j
+    decision: np.ndarray  # int8 [n, m]
+    final: np.ndarray  # int8 [n], the "final" column
+    labels: Dict[int, str]  # {code: cell text}
+
+    @property
+    def vpn_index(self) -> Dict[str, int]:
+        return {vpn: i for i, vpn in enumerate(self.vpns.tolist())}
+
+    @property
+    def anchor_index(self) -> Dict[int, int]:
+        return {prb_id: j for j, prb_id in enumerate(self.anchors.tolist())}
+
+    def valid_ratio(self) -> np.ndarray:
+        """ Share of True/False (not unknown) decisions of every row. """
+        if not self.decision.shape[1]:
+            return np.zeros(len(self.vpns))
+        return np.count_nonzero(self.decision >= 0, axis=1) / self.decision.shape[1]
+
+    def rows(self, keep: np.ndarray) -> "DecisionMatrix":
+        return DecisionMatrix(self.vpns[keep], self.anchors, self.decision[keep], self.final[keep], self.labels)
+
+    def valid(self, threshold: float = 0.6) -> "DecisionMatrix":
+        """ Rows with more than `threshold` known decisions. """
+        return self.rows(self.valid_ratio() > threshold)
+
+
+def encode(cells: np.ndarray, labels: Dict[str, int]) -> np.ndarray:
+    """ int8 codes of an array of cell texts; new unknown markers are added to labels. """
+    codes = np.full(cells.shape, FALSE, dtype=np.int8)
+    is_true = cells == "True"
+    codes[is_true] = TRUE
+    unknown = ~is_true & (cells != "False")
+    for text in np.unique(cells[unknown]).tolist():
+        if text not in labels:
+            labels[text] = -1 - len([c for c in labels.values() if c < 0])
+        codes[unknown & (cells == text)] = labels[text]
+    return codes
+
+
+def parse(fpath: str) -> DecisionMatrix:
+    with open(fpath, "r", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = [row for row in reader if row]
+    n_anchors = len(header) - 2
+    assert all(len(row) == n_anchors + 2 for row in rows)  # "some data is missing!"
+    cells = np.array([row[1:-1] for row in rows], dtype=str).reshape(len(rows), n_anchors)
+    labels = {"True": TRUE, "False": FALSE}
+    decision = encode(cells, labels)
+    final = encode(np.array([row[-1] for row in rows], dtype=str), labels)
+    return DecisionMatrix(np.array([row[0] for row in rows], dtype=str),
+                          np.array([int(prb_id) for prb_id in header[1:-1]], dtype=np.int64),
+                          decision, final, {code: text for text, code in labels.items()})
+
+
+def file_hash(fpath: str) -> str:
+    h = hashlib.sha1()
+    with open(fpath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def cache_path(fpath: str) -> str:
+    return fpath + ".npz"
+
+
+def load(fpath: str, cache: Optional[str] = "") -> DecisionMatrix:
+    """ Parsed final_result.csv, through a binary cache next to it.
+    The cache is used while the CSV's mtime is unchanged; if only the mtime
+    changed, the content hash decides.
+    Args:
+        cache: cache file ("": <fpath>.npz, None: no cache)
+    """
+    if cache == "":
+        cache = cache_path(fpath)
+    mtime = os.stat(fpath).st_mtime_ns
+    digest = None
+    if cache is not None and os.path.exists(cache):
+        with np.load(cache) as d:
+            if int(d['version']) == CACHE_VERSION:
+                if int(d['mtime']) != mtime:
+                    digest = file_hash(fpath)
+                if digest is None or str(d['sha1']) == digest:
+                    labels = dict(zip(d['label_codes'].tolist(), d['label_texts'].tolist()))
+                    matrix = DecisionMatrix(d['vpns'], d['anchors'], d['decision'], d['final'], labels)
+                    if digest is not None:
+                        save(cache, matrix, mtime, digest)
+                    return matrix
+    matrix = parse(fpath)
+    if cache is not None:
+        save(cache, matrix, mtime, digest or file_hash(fpath))
+    return matrix
+
+
+def save(cache: str, matrix: DecisionMatrix, mtime: int, digest: str) -> None:
+    with open(cache + ".tmp", "wb") as f:
+        np.savez(f, version=CACHE_VERSION, mtime=mtime, sha1=digest,
+                 vpns=matrix.vpns, anchors=matrix.anchors, decision=matrix.decision, final=matrix.final,
+                 label_codes=np.array(list(matrix.labels), dtype=np.int8),
+                 label_texts=np.array(list(matrix.labels.values()), dtype=str))
+    os.replace(cache + ".tmp", cache)
@@ -0,0 +1,331 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+## Vectorized pairwise distances between anchors (km).
+## Pairs are laid out as a condensed upper triangle: (0,1), (0,2), ..., (1,2), ...
+
+import os
+import pickle
+import hashlib
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+from geopy.distance import geodesic as GD
+
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+# WGS-84, as used by geopy.distance.geodesic
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = (1 - WGS84_F) * WGS84_A
+# IUGG mean earth radius (km)
+EARTH_RADIUS = 6371.0088
+# in fiber-less vacuum, the lower bound used to drop impossible RTTs (km/ms)
+SPEED_OF_LIGHT = 299.792
+
+MODELS = ("haversine", "vincenty")
+BLOCK_MODELS = MODELS + ("geodesic",)
+
+
+def triu_indices(n: int) -> Tuple[np.ndarray, np.ndarray]:
+    """ Row and column of every pair (i < j) in condensed order. """
+    return np.triu_indices(n, k=1)
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """ Great-circle distance on a sphere of radius EARTH_RADIUS.
+    Fast, but up to ~0.6% off the ellipsoidal distance.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(h, 1.0)))
+
+
+def vincenty(lat1, lon1, lat2, lon2, tol: float = 1e-12, max_iter: int = 200) -> np.ndarray:
+    """ Vincenty's inverse formula on WGS-84, vectorized over all pairs.
+    Converged pairs agree with geopy's geodesic (Karney) to within 1 mm.
+    Nearly antipodal pairs on which the iteration does not converge are
+    handed to geopy, so the result is within 1 mm of geopy for every pair.
+    """
+    lat1, lon1, lat2, lon2 = (np.asarray(x, dtype=np.float64) for x in (lat1, lon1, lat2, lon2))
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sinU1, cosU1 = np.sin(U1), np.cos(U1)
+    sinU2, cosU2 = np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(L.shape, dtype=bool)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cosU2 * sin_lam, cosU1 * sinU2 - sinU1 * cosU2 * cos_lam)
+            cos_sigma = sinU1 * sinU2 + cosU1 * cosU2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # coincident points: sin_sigma == 0
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cosU1 * cosU2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # equatorial line: cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sinU1 * sinU2 / cos2_alpha)
+            C = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * WGS84_F * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam - lam_prev) < tol
+            if converged.all():
+                break
+
+    u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    d_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+        - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+    dist = WGS84_B * A * (sigma - d_sigma) / 1000
+
+    for i in np.flatnonzero(~converged | ~np.isfinite(dist)):
+        dist[i] = GD((lat1[i], lon1[i]), (lat2[i], lon2[i])).km
+    return dist
+
+
+def pairwise(lat, lon, model: str = "vincenty") -> np.ndarray:
+    """ Distances between all pairs of points in condensed order.
+    Args:
+        lat: latitudes (degrees)
+        lon: longitudes (degrees)
+        model: "haversine" (sphere) or "vincenty" (WGS-84, within 1 mm of geopy)
+
+    Returns:
+        float64 array of n * (n - 1) / 2 distances (km)
+    """
+    if model not in MODELS:
+        raise ValueError(f"unknown distance model: {model}, expected one of {MODELS}")
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    i, j = triu_indices(len(lat))
+    if model == "haversine":
+        return haversine(lat[i], lon[i], lat[j], lon[j])
+    return vincenty(lat[i], lon[i], lat[j], lon[j])
+
+
+def to_pairs(pids: List[int], dist: np.ndarray) -> Dict[Tuple[int, int], float]:
+    """ Condensed distances -> {(pid_i, pid_j): km} with i < j, the lm_dist.pickle layout. """
+    i, j = triu_indices(len(pids))
+    pids = np.asarray(pids)
+    return dict(zip(zip(pids[i].tolist(), pids[j].tolist()), dist.tolist()))
+
+
+def row_blocks(n: int, pairs_per_block: int) -> List[Tuple[int, int]]:
+    """ Split rows 0..n-1 of the upper triangle into [start, stop) blocks
+    holding roughly pairs_per_block pairs each.
+    """
+    blocks = []
+    start = 0
+    count = 0
+    for i in range(n - 1):
+        count += n - 1 - i
+        if count >= pairs_per_block:
+            blocks.append((start, i + 1))
+            start = i + 1
+            count = 0
+    if start < n - 1:
+        blocks.append((start, n - 1))
+    return blocks
+
+
+def _block_path(ckpt_dir: str, start: int, stop: int) -> str:
+    return os.path.join(ckpt_dir, f"block_{start:06d}_{stop:06d}.npy")
+
+
+def _compute_block(args) -> Tuple[int, int]:
+    """ Pool worker: distances of rows [start, stop) against all later points,
+    written to the block file only once the block is complete.
+    """
+    lat, lon, start, stop, model, ckpt_dir = args
+    i = np.concatenate([np.full(len(lat) - 1 - r, r) for r in range(start, stop)])
+    j = np.concatenate([np.arange(r + 1, len(lat)) for r in range(start, stop)])
+    if model == "geodesic":
+        dist = np.array([GD((lat[a], lon[a]), (lat[b], lon[b])).km for a, b in zip(i, j)])
+    elif model == "haversine":
+        dist = haversine(lat[i], lon[i], lat[j], lon[j])
+    else:
+        dist = vincenty(lat[i], lon[i], lat[j], lon[j])
+
+    path = _block_path(ckpt_dir, start, stop)
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, dist)
+    os.replace(path + ".tmp", path)
+    return start, stop
+
+
+def pairwise_checkpointed(lat, lon, ckpt_dir: str, model: str = "geodesic",
+                          processes: Optional[int] = None, pairs_per_block: int = 100000) -> np.ndarray:
+    """ pairwise() split into row blocks computed by a process pool.
+    Every finished block is saved under ckpt_dir; a rerun on the same points
+    skips the blocks already on disk, so a crash only loses blocks in flight.
+    Args:
+        lat: latitudes (degrees)
+        lon: longitudes (degrees)
+        ckpt_dir: directory for block files (a subdirectory per point set is used)
+        model: "geodesic" (geopy, exact), "vincenty" or "haversine"
+        processes: pool size (default: cpu count)
+        pairs_per_block: approximate number of pairs per block
+
+    Returns:
+        float64 array of n * (n - 1) / 2 distances (km) in condensed order
+    """
+    if model not in BLOCK_MODELS:
+        raise ValueError(f"unknown distance model: {model}, expected one of {BLOCK_MODELS}")
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    # blocks are only reused for the exact same points, model and split
+    digest = hashlib.sha1(lat.tobytes() + lon.tobytes() + f"{model}/{pairs_per_block}".encode()).hexdigest()
+    ckpt_dir = os.path.join(ckpt_dir, digest[:16])
+    os.makedirs(ckpt_dir, exist_ok=True)
+
+    blocks = row_blocks(len(lat), pairs_per_block)
+    todo = [(start, stop) for start, stop in blocks if not os.path.exists(_block_path(ckpt_dir, start, stop))]
+    print(f"{len(blocks) - len(todo)}/{len(blocks)} blocks already done in {ckpt_dir}")
+    if todo:
+        with mp.Pool(processes=processes) as pool:
+            done = len(blocks) - len(todo)
+            for start, stop in pool.imap_unordered(_compute_block,
+                                                   ((lat, lon, start, stop, model, ckpt_dir) for start, stop in todo)):
+                done += 1
+                print(f"** block {start}-{stop} done ({done}/{len(blocks)})")
+
+    if not blocks:
+        return np.zeros(0)
+    return np.concatenate([np.load(_block_path(ckpt_dir, start, stop)) for start, stop in blocks])
+
+
+def condensed_index(n: int, i, j):
+    """ Position of pair (i, j), i < j, in a condensed array over n points. """
+    return i * n - i * (i + 1) // 2 + (j - i - 1)
+
+
+class DistanceStore:
+    """ Symmetric anchor distance table backed by a condensed float32 array.
+
+    Replaces the {(pid, pid): km} dict of lm_dist.pickle: one pid -> row map
+    plus n * (n - 1) / 2 float32 values (NaN for pairs that were not computed).
+    Saved as two .npy files and memory-mapped on load.
+    """
+
+    def __init__(self, pids, dist) -> None:
+        self.pids = np.asarray(pids, dtype=np.int64)
+        self.dist = dist
+        self.index = {pid: i for i, pid in enumerate(self.pids.tolist())}
+        self._order = np.argsort(self.pids)
+        self._sorted = self.pids[self._order]
+
+    @classmethod
+    def from_condensed(cls, pids: List[int], dist: np.ndarray) -> "DistanceStore":
+        return cls(pids, np.asarray(dist, dtype=np.float32))
+
+    @classmethod
+    def from_pairs(cls, lm_distances: Dict[Tuple[int, int], float]) -> "DistanceStore":
+        """ Convert the {(pid_i, pid_j): km} layout of lm_dist.pickle. """
+        pids = sorted({pid for pair in lm_distances for pid in pair})
+        store = cls(pids, np.full(len(pids) * (len(pids) - 1) // 2, np.nan, dtype=np.float32))
+        if lm_distances:
+            a, b = (store.indices(x) for x in zip(*lm_distances))
+            dist = np.fromiter(lm_distances.values(), dtype=np.float32, count=len(lm_distances))
+            valid = a != b
+            store.dist[store._positions(a[valid], b[valid])] = dist[valid]
+        return store
+
+    @staticmethod
+    def pids_path(fpath: str) -> str:
+        return os.path.splitext(fpath)[0] + ".pids.npy"
+
+    def save(self, fpath: str) -> None:
+        """ Write distances to fpath (.npy) and pids next to it (.pids.npy). """
+        np.save(self.pids_path(fpath), self.pids)
+        np.save(fpath, self.dist)
+
+    @classmethod
+    def load(cls, fpath: str, mmap: bool = True) -> "DistanceStore":
+        dist = np.load(fpath, mmap_mode="r" if mmap else None)
+        return cls(np.load(cls.pids_path(fpath)), dist)
+
+    @classmethod
+    def load_any(cls, fpath: str) -> "DistanceStore":
+        """ Load a .npy store, or convert a {(pid, pid): km} pickle. """
+        if fpath.endswith(".npy"):
+            return cls.load(fpath)
+        with open(fpath, "rb") as f:
+            return cls.from_pairs(pickle.load(f))
+
+    def share(self) -> Tuple[shared_memory.SharedMemory, tuple]:
+        """ Copy the distances into shared memory for pool workers.
+        Returns:
+            (shm, spec): keep shm open while workers run and shm.close() /
+            shm.unlink() afterwards; pass spec to attach() in every worker
+        """
+        shm = shared_memory.SharedMemory(create=True, size=max(self.dist.nbytes, 1))
+        np.ndarray(self.dist.shape, dtype=np.float32, buffer=shm.buf)[:] = self.dist
+        return shm, (shm.name, self.pids, len(self.dist))
+
+    @classmethod
+    def attach(cls, spec: tuple) -> "DistanceStore":
+        """ Store backed by the shared memory of another process's share(). """
+        name, pids, size = spec
+        shm = shared_memory.SharedMemory(name=name)
+        store = cls(pids, np.ndarray((size,), dtype=np.float32, buffer=shm.buf))
+        store._shm = shm  # keep the mapping alive as long as the store
+        return store
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def indices(self, pids) -> np.ndarray:
+        """ Rows of many pids at once, -1 for unknown pids. """
+        pids = np.asarray(pids, dtype=np.int64)
+        if len(self.pids) == 0:
+            return np.full(pids.shape, -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._sorted, pids), len(self.pids) - 1)
+        return np.where(self._sorted[pos] == pids, self._order[pos], -1)
+
+    def _positions(self, i, j) -> np.ndarray:
+        lo = np.minimum(i, j)
+        hi = np.maximum(i, j)
+        return condensed_index(len(self.pids), lo, hi)
+
+    def get(self, pid_a: int, pid_b: int) -> Optional[float]:
+        """ Distance between two anchors in either order, None if unknown. """
+        i = self.index.get(pid_a)
+        j = self.index.get(pid_b)
+        if i is None or j is None or i == j:
+            return None
+        if i > j:
+            i, j = j, i
+        dist = float(self.dist[condensed_index(len(self.pids), i, j)])
+        return None if dist != dist else dist
+
+    def lookup_index(self, i, j) -> np.ndarray:
+        """ Distances for row arrays i and j; NaN for unknown rows or i == j. """
+        i = np.asarray(i, dtype=np.int64)
+        j = np.asarray(j, dtype=np.int64)
+        valid = (i >= 0) & (j >= 0) & (i != j)
+        out = np.full(i.shape, np.nan, dtype=np.float32)
+        out[valid] = self.dist[self._positions(i[valid], j[valid])]
+        return out
+
+    def lookup(self, pids_a, pids_b) -> np.ndarray:
+        """ Distances for many (pid_a, pid_b) pairs at once; NaN where unknown. """
+        return self.lookup_index(self.indices(pids_a), self.indices(pids_b))
+
+    def items(self) -> Iterator[Tuple[Tuple[int, int], float]]:
+        """ ((pid_i, pid_j), km) for every known pair, like dict.items() on lm_dist.pickle. """
+        i, j = triu_indices(len(self.pids))
+        dist = np.asarray(self.dist)
+        known = ~np.isnan(dist)
+        return zip(zip(self.pids[i[known]].tolist(), self.pids[j[known]].tolist()), dist[known].tolist())
@@ -0,0 +1,565 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+## Shared greedy (max-weight prim-like) anchor selection engine
+## used by analyze_air.py (geodesic) and analyze_topo.py (RTT).
+
+import os
+import heapq
+import hashlib
+import pickle
+import multiprocessing as mp
+from collections.abc import Mapping
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Hashable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+)
+
+Adjacency = Dict[Hashable, List[Tuple[Hashable, float]]]
+
+
+class DenseGraph(NamedTuple):
+    W: np.ndarray  # float32 [n, n], 0 where there is no edge
+    linked: np.ndarray  # bool [n, n], True where there is an edge
+    nodes: List[Hashable]  # [node at row i]
+    index: Dict[Hashable, int]  # {node: row}
+
+
+def adjacency(G) -> Adjacency:
+    """ Flatten a weighted networkx graph into plain lists.
+    Args:
+        G: networkx graph with a 'weight' attribute on every edge
+
+    Returns:
+        {node: [(neighbor, weight), ...]} in networkx edge order
+    """
+    return {u: [(v, d['weight']) for v, d in nbrs.items()] for u, nbrs in G.adj.items()}
+
+
+def dense_graph(G, nodes: Optional[List[Hashable]] = None) -> DenseGraph:
+    """ Convert a weighted networkx graph into a dense adjacency matrix.
+    Args:
+        G: networkx graph with a 'weight' attribute on every edge
+        nodes: row order (default: G.nodes())
+
+    Returns:
+        DenseGraph
+    """
+    nodes = list(G.nodes()) if nodes is None else list(nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    n = len(nodes)
+    W = np.zeros((n, n), dtype=np.float32)
+    linked = np.zeros((n, n), dtype=bool)
+    if G.number_of_edges():
+        u, v, w = zip(*((index[u], index[v], d['weight']) for u, v, d in G.edges(data=True)))
+        u = np.array(u)
+        v = np.array(v)
+        W[u, v] = w
+        W[v, u] = w
+        linked[u, v] = True
+        linked[v, u] = True
+    return DenseGraph(W, linked, nodes, index)
+
+
+def iter_greedy(adj: Adjacency, in_tree: Set[Hashable], weights: Dict[Hashable, float]) -> Iterator[Hashable]:
+    """ Repeatedly take the frontier node with the largest total weight
+    towards the nodes selected so far.
+
+    The frontier lives in a lazy-deletion max-heap: every score update pushes a
+    new entry and outdated entries are dropped when they surface. Ties are
+    broken by the order in which nodes entered the frontier, which is what
+    `max(weights, key=weights.get)` did on the insertion-ordered dict.
+
+    Args:
+        adj: adjacency lists, see adjacency()
+        in_tree: nodes already selected; grown in place
+        weights: initial frontier {node: total weight}; consumed in place
+
+    Returns:
+        iterator over the chosen nodes, one per step
+    """
+    seq = {}  # {node: position at which it entered the frontier}
+    heap = []  # [(-score, seq, node)]
+    for node, w in weights.items():
+        seq[node] = len(seq)
+        heap.append((-w, seq[node], node))
+    heapq.heapify(heap)
+
+    while weights:
+        neg_w, _, node = heapq.heappop(heap)
+        if weights.get(node) != -neg_w:
+            continue  # stale entry
+        del weights[node]
+        in_tree.add(node)
+        yield node
+
+        for nbr, w in adj.get(node, ()):
+            if nbr in in_tree:
+                # remove duplication; we already have this edge in our selection
+                continue
+            if nbr not in weights:
+                weights[nbr] = 0
+                seq[nbr] = len(seq)
+            weights[nbr] += w
+            heapq.heappush(heap, (-weights[nbr], seq[nbr], nbr))
+
+
+def iter_greedy_clusters(adj: Adjacency, in_tree: Set[Hashable], weights: Dict[Hashable, float],
+                         cluster_of: Dict[Hashable, Hashable], covered: Set[Hashable]) -> Iterator[Hashable]:
+    """ iter_greedy() that prefers clusters (city, country, asn, ...) not covered yet:
+    each step takes the best frontier node of an uncovered cluster and marks the
+    cluster covered; once no frontier node has an uncovered cluster, the best
+    node overall. Ties are broken as in iter_greedy().
+
+    Besides the heap of iter_greedy(), frontier nodes of uncovered clusters are
+    kept in a second lazy-deletion heap whose entries are dropped when they
+    surface after their cluster got covered, so a step is a few heap operations
+    instead of a sort of the frontier.
+
+    Args:
+        adj: adjacency lists, see adjacency()
+        in_tree: nodes already selected; grown in place
+        weights: initial frontier {node: total weight}; consumed in place
+        cluster_of: {node: cluster} of every node that can be selected
+        covered: clusters already covered; grown in place
+
+    Returns:
+        iterator over the chosen nodes, one per step
+    """
+    seq = {}  # {node: position at which it entered the frontier}
+    heap = []  # [(-score, seq, node)] of the whole frontier
+    uncovered = []  # [(-score, seq, node)] of frontier nodes whose cluster was uncovered at push time
+
+    def push(node):
+        entry = (-weights[node], seq[node], node)
+        heapq.heappush(heap, entry)
+        if cluster_of[node] not in covered:
+            heapq.heappush(uncovered, entry)
+
+    for node in weights:
+        seq[node] = len(seq)
+        push(node)
+
+    while weights:
+        node = None
+        while uncovered:
+            neg_w, _, cand = heapq.heappop(uncovered)
+            if weights.get(cand) == -neg_w and cluster_of[cand] not in covered:
+                node = cand
+                covered.add(cluster_of[node])
+                break
+        while node is None:
+            neg_w, _, cand = heapq.heappop(heap)
+            if weights.get(cand) == -neg_w:
+                node = cand
+        del weights[node]
+        in_tree.add(node)
+        yield node
+
+        for nbr, w in adj.get(node, ()):
+            if nbr in in_tree:
+                # remove duplication; we already have this edge in our selection
+                continue
+            if nbr not in weights:
+                weights[nbr] = 0
+                seq[nbr] = len(seq)
+            weights[nbr] += w
+            push(nbr)
+
+
+def iter_greedy_dense(D: DenseGraph, selected: List[Hashable],
+                      weights: Dict[Hashable, float]) -> Iterator[Hashable]:
+    """ Same greedy as iter_greedy() on a DenseGraph: each step is one row add
+    plus a masked argmax. Scores are accumulated in float32 and ties are broken
+    by row order, so near-ties may resolve differently from the heap engine.
+    Args:
+        D: see dense_graph()
+        selected: nodes already selected
+        weights: initial frontier {node: total weight}
+
+    Returns:
+        iterator over the chosen nodes, one per step
+    """
+    n = len(D.nodes)
+    score = np.zeros(n, dtype=np.float32)
+    frontier = np.zeros(n, dtype=bool)
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[[D.index[node] for node in selected]] = True
+    for node, w in weights.items():
+        score[D.index[node]] = w
+        frontier[D.index[node]] = True
+    frontier &= ~in_tree
+
+    while frontier.any():
+        i = int(np.argmax(np.where(frontier, score, -np.inf)))
+        in_tree[i] = True
+        yield D.nodes[i]
+
+        score += D.W[i]
+        frontier |= D.linked[i]
+        frontier &= ~in_tree
+
+
+def batch_greedy(D: DenseGraph, starts: List[Hashable], chunk: int = 256) -> Dict[Hashable, List[Hashable]]:
+    """ Run iter_greedy_dense() from many start nodes in lockstep: one score row
+    per distinct start node, every step is a row-wise masked argmax followed
+    by a gathered row add. Start nodes shared by several callers (e.g. VPs
+    claiming the same country) are computed only once.
+    Args:
+        D: see dense_graph()
+        starts: start node of every run, duplicates allowed
+        chunk: number of rows advanced together (bounds memory to chunk * n)
+
+    Returns:
+        {start node: [selected nodes in order, starting with the start node]}
+    """
+    uniq = list(dict.fromkeys(starts))
+    n = len(D.nodes)
+    orders = {}
+    for c in range(0, len(uniq), chunk):
+        rows = np.array([D.index[s] for s in uniq[c:c + chunk]], dtype=np.int64)
+        ar = np.arange(len(rows))
+        score = D.W[rows].copy()
+        in_tree = np.zeros((len(rows), n), dtype=bool)
+        in_tree[ar, rows] = True
+        frontier = D.linked[rows] & ~in_tree
+        order = np.full((len(rows), n), -1, dtype=np.int64)
+        order[:, 0] = rows
+
+        for step in range(1, n):
+            active = ar[frontier.any(axis=1)]
+            if len(active) == 0:
+                break
+            pick = np.argmax(np.where(frontier[active], score[active], -np.inf), axis=1)
+            order[active, step] = pick
+            in_tree[active, pick] = True
+            score[active] += D.W[pick]
+            frontier[active] = (frontier[active] | D.linked[pick]) & ~in_tree[active]
+
+        for s, row in zip(uniq[c:c + chunk], order):
+            orders[s] = [D.nodes[i] for i in row[row >= 0]]
+    return orders
+
+
+class Selection(Mapping):
+    """ Result of a greedy run: the anchors in the order they were selected,
+    read like the former {k: [anchors selected up to step k]} dicts.
+
+    Only the order and the length of every k-prefix are stored (O(n) instead
+    of a list copy per k); max_strees[k] builds the list on demand and
+    prefix(k) returns it as a numpy array.
+
+    Keys are consecutive. Setting max_strees[k] = anchors only appends the part
+    of anchors beyond what is stored, so anchors must extend the earlier
+    selections (as a growing selection does); setting an existing k drops the
+    keys from k on first.
+    """
+
+    def __init__(self) -> None:
+        self.first_k = None  # smallest key
+        self.order = []  # [anchor] in selection order
+        self.ends = []  # [length of the prefix of key first_k + i]
+
+    @classmethod
+    def from_order(cls, order: List[Hashable], start_index: int = 2) -> "Selection":
+        """ {k: order[:k]} for k = start_index .. len(order) """
+        sel = cls()
+        sel.first_k = start_index
+        sel.order = list(order)
+        sel.ends = list(range(start_index, len(sel.order) + 1))
+        return sel
+
+    def __setitem__(self, k: int, anchors: List[Hashable]) -> None:
+        if self.first_k is None:
+            self.first_k = k
+        i = k - self.first_k
+        if not 0 <= i <= len(self.ends):
+            raise KeyError(f"{k} does not follow the keys {self.first_k}..{self.first_k + len(self.ends) - 1}")
+        del self.ends[i:]
+        self.order.extend(anchors[len(self.order):])
+        self.ends.append(len(anchors))
+
+    def _end(self, k: int) -> int:
+        i = -1 if self.first_k is None else k - self.first_k
+        if not 0 <= i < len(self.ends):
+            raise KeyError(k)
+        return self.ends[i]
+
+    def __getitem__(self, k: int) -> List[Hashable]:
+        return self.order[:self._end(k)]
+
+    def prefix(self, k: int) -> np.ndarray:
+        """ Anchors selected up to step k as a numpy array. """
+        return np.asarray(self.order)[:self._end(k)]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.first_k, self.first_k + len(self.ends)) if self.ends else ())
+
+    def __len__(self) -> int:
+        return len(self.ends)
+
+    def __repr__(self) -> str:
+        return f"Selection(first_k={self.first_k}, order={self.order!r})"
+
+    def copy(self) -> "Selection":
+        sel = Selection()
+        sel.first_k, sel.order, sel.ends = self.first_k, list(self.order), list(self.ends)
+        return sel
+
+    def to_dict(self) -> Dict[int, List[Hashable]]:
+        """ The former {k: [anchors]} dict (a list copy per k). """
+        return {k: self[k] for k in self}
+
+    def to_payload(self) -> dict:
+        """ {'first_k': int, 'order': [anchors], 'ends': [prefix length of every k]},
+        plain data that unpickles without this module.
+        """
+        return {'first_k': self.first_k, 'order': list(self.order), 'ends': list(self.ends)}
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> "Selection":
+        sel = cls()
+        sel.first_k, sel.order, sel.ends = payload['first_k'], list(payload['order']), list(payload['ends'])
+        return sel
+
+
+PAYLOAD_KEYS = {'first_k', 'order', 'ends'}
+
+
+def to_payload(selections):
+    """ What select_prim() callers pickle: the payload of a Selection, or
+    {vp_id: payload} of {vp_id: Selection} (VPs sharing a Selection share the payload).
+    """
+    if isinstance(selections, Selection):
+        return selections.to_payload()
+    payloads = {}  # {id(Selection): payload}
+    for sel in selections.values():
+        if id(sel) not in payloads:
+            payloads[id(sel)] = sel.to_payload()
+    return {vp_id: payloads[id(sel)] for vp_id, sel in selections.items()}
+
+
+def from_payload(obj):
+    """ Selection (or {vp_id: Selection}) of an unpickled to_payload() result. """
+    if isinstance(obj, dict) and obj.keys() == PAYLOAD_KEYS:
+        return Selection.from_payload(obj)
+    selections = {}  # {id(payload): Selection}
+    for payload in obj.values():
+        if id(payload) not in selections:
+            selections[id(payload)] = Selection.from_payload(payload)
+    return {vp_id: selections[id(payload)] for vp_id, payload in obj.items()}
+
+
+def prefixes(order: List[Hashable], start_index: int = 2) -> Selection:
+    """ {k: [first k selected nodes]} as stored by select_prim(). """
+    return Selection.from_order(order, start_index)
+
+
+def select_prim(G, weights: Dict[Hashable, float], MAXG, max_strees: Dict[int, List[Any]],
+                start_index: int = 2, dense: Optional[DenseGraph] = None,
+                cluster_of: Optional[Dict[Hashable, Hashable]] = None, covered: Optional[Set[Hashable]] = None) -> None:
+    """ Drop-in engine for the `_select_prim` loops of the analysis scripts.
+    Args:
+        G: anchor graph
+        weights: initial frontier {node: total weight}; consumed in place
+        MAXG: graph holding the already selected nodes; grown in place
+        max_strees: {k: [anchors]}, preferably a Selection; filled in place from k = start_index on
+        start_index: k of the first node chosen here
+        dense: dense_graph(G) to run the vectorized engine, None for the heap engine
+        cluster_of: {node: cluster} to prefer uncovered clusters, see iter_greedy_clusters() (dense is ignored)
+        covered: clusters already covered, with cluster_of
+    """
+    selected = list(MAXG.nodes())
+    in_tree = set(selected)
+    if cluster_of is not None:
+        steps = iter_greedy_clusters(adjacency(G), set(selected), weights, cluster_of,
+                                     set() if covered is None else covered)
+    elif dense is None:
+        steps = iter_greedy(adjacency(G), set(selected), weights)
+    else:
+        steps = iter_greedy_dense(dense, selected, weights)
+
+    k = start_index
+    for node in steps:
+        if k > G.number_of_nodes():
+            break
+        if node not in in_tree:
+            in_tree.add(node)
+            selected.append(node)
+            MAXG.add_node(node)
+        # a Selection only copies the new tail; a plain dict needs its own list per k
+        max_strees[k] = selected if isinstance(max_strees, Selection) else selected.copy()
+        k += 1
+
+
+class SharedGraph:
+    """ Adjacency lists of an anchor graph as flat arrays (CSR, networkx edge
+    order kept) that pool workers map from shared memory instead of receiving
+    a copy of the graph. Nodes must be integers (anchor ids).
+    get() has the interface of an Adjacency dict, so iter_greedy() and
+    iter_greedy_clusters() run on it unchanged and make the same choices.
+    """
+
+    def __init__(self, nodes: np.ndarray, indptr: np.ndarray, nbrs: np.ndarray, weights: np.ndarray) -> None:
+        self.nodes = nodes  # int64 [n]
+        self.indptr = indptr  # int64 [n + 1], neighbors of nodes[i] are nbrs[indptr[i]:indptr[i + 1]]
+        self.nbrs = nbrs  # int64 [2m], neighbor node ids
+        self.weights = weights  # float64 [2m]
+        self.index = {node: i for i, node in enumerate(nodes.tolist())}
+        self._shms = []
+
+    @classmethod
+    def from_graph(cls, G) -> "SharedGraph":
+        adj = adjacency(G)
+        degree = [len(adj[node]) for node in adj]
+        return cls(np.array(list(adj), dtype=np.int64),
+                   np.concatenate(([0], np.cumsum(degree, dtype=np.int64))),
+                   np.array([v for node in adj for v, w in adj[node]], dtype=np.int64),
+                   np.array([w for node in adj for v, w in adj[node]], dtype=np.float64))
+
+    def get(self, node: Hashable, default=()) -> Iterator[Tuple[Hashable, float]]:
+        i = self.index.get(node)
+        if i is None:
+            return iter(default)
+        a, b = self.indptr[i], self.indptr[i + 1]
+        return zip(self.nbrs[a:b].tolist(), self.weights[a:b].tolist())
+
+    def fingerprint(self, cluster_of: Optional[Dict[Hashable, Hashable]] = None) -> str:
+        """ sha1 of the arrays and of cluster_of, to tell whether saved runs used the same inputs. """
+        h = hashlib.sha1()
+        for arr in (self.nodes, self.indptr, self.nbrs, self.weights):
+            h.update(arr.tobytes())
+        if cluster_of is not None:
+            h.update(repr(sorted((repr(node), repr(cluster)) for node, cluster in cluster_of.items())).encode())
+        return h.hexdigest()
+
+    def share(self) -> Tuple[List[shared_memory.SharedMemory], list]:
+        """ Copy the arrays into shared memory.
+        Returns:
+            (shms, spec): close() and unlink() every shm once the workers are
+            done; pass spec to attach() in every worker
+        """
+        shms, spec = [], []
+        for arr in (self.nodes, self.indptr, self.nbrs, self.weights):
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+            shms.append(shm)
+            spec.append((shm.name, arr.dtype.str, arr.shape))
+        return shms, spec
+
+    @classmethod
+    def attach(cls, spec: list) -> "SharedGraph":
+        """ Graph backed by the shared memory of another process's share(). """
+        shms = [shared_memory.SharedMemory(name=name) for name, _, _ in spec]
+        graph = cls(*(np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+                      for shm, (_, dtype, shape) in zip(shms, spec)))
+        graph._shms = shms  # keep the mappings alive as long as the graph
+        return graph
+
+
+_WORKER = None  # (SharedGraph, cluster_of) of a pool worker, set by init_worker()
+
+
+def init_worker(spec: list, cluster_of: Optional[Dict[Hashable, Hashable]] = None) -> None:
+    """ mp.Pool initializer: attach to the graph shared by SharedGraph.share(). """
+    global _WORKER
+    _WORKER = (SharedGraph.attach(spec), cluster_of)
+
+
+def run_from(start: Hashable) -> Tuple[Hashable, List[Hashable]]:
+    """ One greedy run in a pool worker, as select_prim() does for one start anchor.
+    Returns:
+        (start, [selected nodes in order, starting with start])
+    """
+    graph, cluster_of = _WORKER
+    weights = dict(graph.get(start))
+    if cluster_of is None:
+        steps = iter_greedy(graph, {start}, weights)
+    else:
+        steps = iter_greedy_clusters(graph, {start}, weights, cluster_of, set())
+    return start, [start, *steps]
+
+
+def select_parallel(G, start_point_vp: Dict[Hashable, Hashable], fpath: str, processes: Optional[int] = None,
+                    cluster_of: Optional[Dict[Hashable, Hashable]] = None,
+                    progress: Optional[Callable[[int, int], None]] = None) -> Dict[Hashable, Selection]:
+    """ select_prim() of every VP's start anchor over a process pool.
+    The graph is put into shared memory once; each distinct start anchor is
+    one task. Every finished VP is appended right away to fpath + ".partial"
+    as (vp_id, start, order), after a first record with the fingerprint of
+    the graph and cluster_of; VPs already found there (e.g. after a crash) are
+    not run again, unless the fingerprint differs and the file is discarded.
+    At the end {vp_id: Selection} is pickled to fpath (as to_payload()) and
+    the partial file removed.
+    Args:
+        G: anchor graph
+        start_point_vp: {vp_id: start anchor}
+        fpath: output pickle
+        processes: pool size (None: all cores)
+        cluster_of: {node: cluster} to prefer uncovered clusters, see iter_greedy_clusters()
+        progress: called with (done, total) after every finished start anchor
+
+    Returns:
+        {vp_id: Selection}, VPs sharing a start anchor share the Selection
+    """
+    graph = SharedGraph.from_graph(G)
+    fingerprint = graph.fingerprint(cluster_of)
+    fpath_partial = fpath + ".partial"
+    orders = {}  # {start anchor: order}
+    if os.path.exists(fpath_partial):
+        with open(fpath_partial, "r+b") as f:
+            good = 0
+            try:
+                if pickle.load(f) == ("fingerprint", fingerprint):
+                    good = f.tell()
+                    while True:
+                        vp_id, start, order = pickle.load(f)
+                        orders[start] = order
+                        good = f.tell()
+                else:
+                    print(f"discard {fpath_partial}: another graph or cluster_of")
+            except (EOFError, pickle.UnpicklingError, ValueError, TypeError):
+                pass  # end of file, or a record cut short by a crash
+            f.truncate(good)
+
+    vps_by_start = {}  # {start anchor: [vp_id, ...]}
+    for vp_id, start in start_point_vp.items():
+        vps_by_start.setdefault(start, []).append(vp_id)
+    todo = [start for start in vps_by_start if start not in orders]
+
+    shms, spec = graph.share()
+    try:
+        with open(fpath_partial, "ab") as f, \
+                mp.Pool(processes, initializer=init_worker, initargs=(spec, cluster_of)) as pool:
+            if not f.tell():
+                pickle.dump(("fingerprint", fingerprint), f)
+            for count, (start, order) in enumerate(pool.imap_unordered(run_from, todo), 1):
+                orders[start] = order
+                for vp_id in vps_by_start[start]:
+                    pickle.dump((vp_id, start, order), f)
+                f.flush()
+                if progress is not None:
+                    progress(count, len(todo))
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+    selections = {start: Selection.from_order(orders[start]) for start in vps_by_start}
+    all_mst = {vp_id: selections[start] for vp_id, start in start_point_vp.items()}
+    with open(fpath, "wb") as fp:
+        pickle.dump(to_payload(all_mst), fp)
+    os.remove(fpath_partial)
+    return all_mst
@@ -0,0 +1,224 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+## Landmark (anchor) metadata of anchorSelectionAll.csv, parsed once into columns.
+## Header: addr, aid, pid, longitude, latitude, city, country, anchors p, probes p, asn
+
+import os
+import csv
+import pickle
+import hashlib
+from functools import cached_property, lru_cache
+
+import numpy as np
+import pycountry_convert as pc
+
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+@lru_cache(maxsize=None)
+def continent_code(country: str) -> str:
+    if country == 'SX':
+        # Sint Maarten is missing from pycountry_convert
+        return 'NA'
+    return pc.country_alpha2_to_continent_code(country)
+
+
+@lru_cache(maxsize=None)
+def continent_name(country: str) -> str:
+    return pc.convert_continent_code_to_continent_name(continent_code(country))
+
+
+class LandmarkIndex:
+    """ Parallel arrays, one row per line of the csv (in file order).
+    Groupings and lookups are computed on first use and kept.
+    """
+
+    def __init__(self, pid, lat, lon, city, country, asn) -> None:
+        self.pid = np.asarray(pid, dtype=np.int64)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.city = np.asarray(city, dtype=str)
+        self.country = np.asarray(country, dtype=str)
+        self.asn = np.asarray(asn, dtype=str)  # as written in the csv, see groups()
+
+    @classmethod
+    def from_csv(cls, fpath: str) -> "LandmarkIndex":
+        with open(fpath, "rt") as fp:
+            rows = list(csv.DictReader(fp))
+        return cls([int(row['pid'].strip()) for row in rows],
+                   [float(row['latitude'].strip()) for row in rows],
+                   [float(row['longitude'].strip()) for row in rows],
+                   [row['city'] for row in rows],
+                   [row['country'] for row in rows],
+                   [row['asn'] for row in rows])
+
+    def __len__(self) -> int:
+        return len(self.pid)
+
+    def subset(self, pids: Iterable[int]) -> "LandmarkIndex":
+        """ Rows whose pid is in pids, in file order. """
+        keep = np.isin(self.pid, np.fromiter(pids, dtype=np.int64))
+        return LandmarkIndex(self.pid[keep], self.lat[keep], self.lon[keep],
+                             self.city[keep], self.country[keep], self.asn[keep])
+
+    @cached_property
+    def continent_code(self) -> np.ndarray:
+        uniq, inv = np.unique(self.country, return_inverse=True)
+        return np.array([continent_code(c) for c in uniq.tolist()], dtype=str)[inv] if len(uniq) else uniq
+
+    @cached_property
+    def continent(self) -> np.ndarray:
+        uniq, inv = np.unique(self.country, return_inverse=True)
+        return np.array([continent_name(c) for c in uniq.tolist()], dtype=str)[inv] if len(uniq) else uniq
+
+    @cached_property
+    def row(self) -> Dict[int, int]:
+        """ {pid: row} (the last row of a repeated pid) """
+        return {pid: i for i, pid in enumerate(self.pid.tolist())}
+
+    @cached_property
+    def coordinates(self) -> Dict[int, Tuple[float, float]]:
+        """ {pid: (latitude, longitude)} """
+        return dict(zip(self.pid.tolist(), zip(self.lat.tolist(), self.lon.tolist())))
+
+    @cached_property
+    def _groups(self) -> dict:
+        return {}
+
+    def groups(self, column: str) -> Dict[object, List[int]]:
+        """ {value: [pids]} for column "city", "country", "asn" (int) or "continent" (name). """
+        if column not in self._groups:
+            values = getattr(self, column).tolist()
+            if column == "asn":
+                values = [int(asn) for asn in values]
+            groups = {}
+            for value, pid in zip(values, self.pid.tolist()):
+                groups.setdefault(value, []).append(pid)
+            self._groups[column] = groups
+        return self._groups[column]
+
+    @cached_property
+    def categories(self) -> dict:
+        """ {'city': {city: [pids]}, 'country': ..., 'asn': ..., 'continent': ..., 'anchors': [pids]} """
+        abc = {column: self.groups(column) for column in ('city', 'country', 'asn', 'continent')}
+        abc['anchors'] = self.pid.tolist()
+        return abc
+
+    @cached_property
+    def meta(self) -> Dict[int, Dict[str, str]]:
+        """ {pid: {'city': str, 'country': str, 'asn': str, 'continent': str}} """
+        return {pid: {'city': city, 'country': country, 'asn': asn, 'continent': continent}
+                for pid, city, country, asn, continent in zip(self.pid.tolist(), self.city.tolist(),
+                                                              self.country.tolist(), self.asn.tolist(),
+                                                              self.continent.tolist())}
+
+    @cached_property
+    def countries_by_continent(self) -> Dict[str, Dict[str, List[int]]]:
+        """ {continent name: {country: [pids]}} """
+        rv = {}
+        for continent, country, pid in zip(self.continent.tolist(), self.country.tolist(), self.pid.tolist()):
+            rv.setdefault(continent, {}).setdefault(country, []).append(pid)
+        return rv
+
+
+_INDEXES = {}  # {(real path, mtime): LandmarkIndex}
+
+
+def load(fpath: str) -> LandmarkIndex:
+    """ LandmarkIndex of fpath, parsed once per process (again if the file changes). """
+    key = (os.path.realpath(fpath), os.stat(fpath).st_mtime_ns)
+    if key not in _INDEXES:
+        _INDEXES[key] = LandmarkIndex.from_csv(fpath)
+    return _INDEXES[key]
+
+
+def connected_anchors(G) -> np.ndarray:
+    """ Sorted pids of the nodes of G with at least one edge. """
+    return np.array(sorted(node for node, degree in G.degree() if degree > 0), dtype=np.int64)
+
+
+def nearest_anchor_ranking(fpath_distance: str, G, fpath_cache: Optional[str] = None) -> Dict[str, List[int]]:
+    """ Anchors by increasing (numeric) distance to every country, keeping only
+    anchors with an edge in G.
+    Args:
+        fpath_distance: landmarks-and-distances_pid.csv, header: addr, pid, longitude, latitude, <iso3> ...
+        G: anchor graph
+        fpath_cache: pickle kept alongside the graph, reused while the csv and
+                     the connected anchors of G are unchanged (None: no cache)
+
+    Returns:
+        {iso3: [pid, ...]}, nearest first; equal distances keep the csv order
+    """
+    connected = connected_anchors(G)
+    stat = os.stat(fpath_distance)
+    key = (os.path.realpath(fpath_distance), stat.st_mtime_ns, stat.st_size,
+           hashlib.sha1(connected.tobytes()).hexdigest())
+    if fpath_cache is not None and os.path.exists(fpath_cache):
+        with open(fpath_cache, "rb") as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            return cached['ranking']
+
+    with open(fpath_distance, "rt") as ft:
+        reader = csv.reader(ft)
+        header = next(reader)
+        rows = [row for row in reader if row]
+    pid_col = header.index('pid')
+    countries = [(j, name) for j, name in enumerate(header) if name not in ('addr', 'pid', 'longitude', 'latitude')]
+    pids = np.array([int(row[pid_col]) for row in rows], dtype=np.int64)
+    dist = np.array([[float(row[j]) if row[j].strip() else np.nan for j, _ in countries] for row in rows],
+                    dtype=np.float64).reshape(len(rows), len(countries))
+    usable = np.isin(pids, connected)[:, None] & ~np.isnan(dist)
+
+    ranking = {}
+    for c, (_, iso3) in enumerate(countries):
+        rows_c = np.flatnonzero(usable[:, c])
+        ranking[iso3] = pids[rows_c[np.argsort(dist[rows_c, c], kind="stable")]].tolist()
+
+    if fpath_cache is not None:
+        with open(fpath_cache + ".tmp", "wb") as f:
+            pickle.dump({'key': key, 'ranking': ranking}, f)
+        os.replace(fpath_cache + ".tmp", fpath_cache)
+    return ranking
+
+
+def connected_pools(anchors_by_cnt: Dict[str, List[int]], G) -> Dict[str, List[int]]:
+    """ {country: [pids]} restricted to anchors with an edge in G; countries left empty are dropped. """
+    pools = {}
+    for country, pids in anchors_by_cnt.items():
+        pool = [pid for pid in pids if G.has_node(pid) and G.degree(pid) > 0]
+        if pool:
+            pools[country] = pool
+    return pools
+
+
+def sample_start_points(countries: List[str], pools: Dict[str, List[int]],
+                        seed: Optional[int] = None) -> List[Optional[int]]:
+    """ One anchor drawn uniformly from pools[country] for every entry of countries,
+    all in one vectorized pass.
+    Args:
+        countries: claimed country of every VP
+        pools: {country: [pids]}, see connected_pools()
+        seed: seed of the generator; the same seed gives the same draws
+
+    Returns:
+        [pid or None (no anchor in the pool of the country)], aligned with countries
+    """
+    rng = np.random.default_rng(seed)
+    draws = rng.random(len(countries))
+    names = list(pools)
+    slot = {country: i for i, country in enumerate(names)}
+    sizes = np.array([len(pools[c]) for c in names] + [0], dtype=np.int64)  # last: no pool
+    offsets = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    flat = np.array([pid for c in names for pid in pools[c]] + [-1], dtype=np.int64)
+    which = np.array([slot.get(country, len(names)) for country in countries], dtype=np.int64)
+    # countries without a pool land on the trailing -1
+    picked = flat[offsets[which] + (draws * sizes[which]).astype(np.int64)]
+    return [None if pid == -1 else pid for pid in picked.tolist()]
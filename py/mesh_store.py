@@ -0,0 +1,145 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Local, append-only store of anchor mesh ping results.
+# Every measurement keeps the disjoint time ranges it covers: retrieval only
+# asks the API for results outside of them (normally just after the
+# high-water timestamp), and any covered time window is served locally.
+# The last `lag` seconds before now are never marked covered, since Atlas
+# publishes results late; they are fetched again by the next run and the
+# samples seen twice are merged on read.
+#
+# layout: <root>/meta.json    {msm_id: {"target": pid, "start": "%m-%d-%Y", "covered": [[first ts, last ts], ...]}}
+#         <root>/<msm_id>/<first ts>_<last ts>[_<n>].npz   columns origin, timestamp, rtt
+
+import os
+import json
+import time
+import threading
+
+import numpy as np
+
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+class MeshStore:
+    """
+    Args:
+        root: store directory, created if missing
+        lag: seconds before now that stay uncovered, for results published late
+    """
+
+    def __init__(self, root: str, lag: int = 900) -> None:
+        self.root = root
+        self.lag = lag
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.meta = {}
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "rt") as f:
+                self.meta = {int(k): v for k, v in json.load(f).items()}
+
+    @property
+    def meta_path(self) -> str:
+        return os.path.join(self.root, "meta.json")
+
+    def watermark(self, msm_id: int) -> Optional[int]:
+        """ Unix timestamp up to which results of msm_id are stored, None if never fetched. """
+        meta = self.meta.get(msm_id)
+        return None if meta is None or not meta['covered'] else meta['covered'][-1][1]
+
+    def missing(self, msm_id: int, start: int, stop: int) -> List[Tuple[int, int]]:
+        """ Parts of [start, stop] not covered by the store yet. """
+        ranges = []
+        meta = self.meta.get(msm_id)
+        for first, last in ([] if meta is None else meta['covered']):
+            if last < start or first > stop:
+                continue
+            if first > start:
+                ranges.append((start, first - 1))
+            start = last + 1
+        if start <= stop:
+            ranges.append((start, stop))
+        return ranges
+
+    def append(self, mesh_pings: dict, start: int, stop: int) -> None:
+        """ Store newly fetched results; [start, stop] (up to now - lag) is now
+        covered for their measurements.
+        Args:
+            mesh_pings: {(target_prb_id, msm_id, meas_start_time): {org_prb_id: [(timestamp, minimum_rtt)]}}
+            start: unix timestamp of the window the results were fetched for
+            stop: unix timestamp of the end of that window
+        """
+        for (target_prb_id, msm_id, meas_start_time), origins in mesh_pings.items():
+            origin = np.array([o for o, pings in origins.items() for _ in pings], dtype=np.int64)
+            ts = np.array([p[0] for pings in origins.values() for p in pings], dtype=np.int64)
+            rtt = np.array([p[1] for pings in origins.values() for p in pings], dtype=np.float64)
+            if len(ts):
+                msm_dir = os.path.join(self.root, str(msm_id))
+                os.makedirs(msm_dir, exist_ok=True)
+                fpath = os.path.join(msm_dir, f"{ts.min()}_{ts.max()}.npz")
+                n = 1
+                while os.path.exists(fpath):
+                    # a re-fetched overlap may span the same timestamps: keep both chunks
+                    fpath = os.path.join(msm_dir, f"{ts.min()}_{ts.max()}_{n}.npz")
+                    n += 1
+                with open(fpath + ".tmp", "wb") as f:
+                    np.savez_compressed(f, origin=origin, timestamp=ts, rtt=rtt)
+                os.replace(fpath + ".tmp", fpath)
+            last = min(stop, int(time.time()) - self.lag)
+            with self.lock:
+                covered = [] if msm_id not in self.meta else self.meta[msm_id]['covered']
+                if start <= last:
+                    covered = merge(covered + [[start, last]])
+                self.meta[msm_id] = {"target": target_prb_id, "start": meas_start_time, "covered": covered}
+
+    def save(self) -> None:
+        """ Write meta.json, once per run after the last append(). Chunks appended
+        after the last save are not covered: they are fetched again and merged on read.
+        """
+        with self.lock:
+            with open(self.meta_path + ".tmp", "wt") as f:
+                json.dump(self.meta, f)
+            os.replace(self.meta_path + ".tmp", self.meta_path)
+
+    def window(self, start: int, stop: int) -> Dict[tuple, dict]:
+        """ Stored results with start <= timestamp <= stop, in the layout of retrieve_topo.py:
+        {(target_prb_id, msm_id, meas_start_time): {org_prb_id: [(timestamp, minimum_rtt)]}}
+        """
+        mesh_pings = {}
+        for msm_id, meta in self.meta.items():
+            msm_dir = os.path.join(self.root, str(msm_id))
+            if not os.path.isdir(msm_dir):
+                continue
+            samples = {}  # {org_prb_id: {timestamp: rtt}}, chunks fetched twice overlap
+            for fname in sorted(os.listdir(msm_dir)):
+                if not fname.endswith(".npz"):
+                    continue
+                first, last = (int(x) for x in fname[:-len(".npz")].split("_")[:2])
+                if last < start or first > stop:
+                    continue
+                with np.load(os.path.join(msm_dir, fname)) as chunk:
+                    keep = (chunk['timestamp'] >= start) & (chunk['timestamp'] <= stop)
+                    for o, ts, rtt in zip(chunk['origin'][keep].tolist(), chunk['timestamp'][keep].tolist(),
+                                          chunk['rtt'][keep].tolist()):
+                        samples.setdefault(o, {})[ts] = rtt
+            if samples:
+                mesh_pings[(meta['target'], msm_id, meta['start'])] = {o: sorted(pings.items())
+                                                                       for o, pings in samples.items()}
+        return mesh_pings
+
+
+def merge(ranges: List[List[int]]) -> List[List[int]]:
+    """ Sorted, disjoint [first, last] ranges; overlapping or adjacent ones are joined. """
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
@@ -0,0 +1,129 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Columnar on-disk format of anchor mesh pings, replacing the nested
+# {(target, msm_id, date): {origin: [(timestamp, rtt)]}} pickles.
+# Rows are parallel arrays, written in compressed chunks; every chunk's time
+# range and targets are kept in meta.json so that reads filtered by time or
+# anchors skip whole chunks and only load the others one at a time.
+#
+# layout: <fpath>/meta.json   {"msm": {msm_id: "%m-%d-%Y"},
+#                              "chunks": [{"file", "rows", "tmin", "tmax", "targets"}]}
+#         <fpath>/<n>.npz      columns target, origin, msm_id, timestamp, min_rtt
+
+import os
+import json
+
+import numpy as np
+
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    Optional,
+)
+
+SUFFIX = ".columns"
+COLUMNS = ("target", "origin", "msm_id", "timestamp", "min_rtt")
+DTYPES = {"target": np.int32, "origin": np.int32, "msm_id": np.int32, "timestamp": np.int64, "min_rtt": np.float64}
+
+
+class PingWriter:
+    """ Appends mesh pings to a columnar directory, one chunk per chunk_rows rows.
+    Args:
+        fpath: output directory, e.g. "../pickle/mesh_pings_12-08-2022_1.columns"
+        chunk_rows: rows per compressed chunk
+    """
+
+    def __init__(self, fpath: str, chunk_rows: int = 1 << 20) -> None:
+        self.fpath = fpath
+        self.chunk_rows = chunk_rows
+        self.meta = {"msm": {}, "chunks": []}
+        self.buf = {c: [] for c in COLUMNS}
+        os.makedirs(fpath, exist_ok=True)
+
+    def write(self, mesh_pings: dict) -> None:
+        """
+        Args:
+            mesh_pings: {(target_prb_id, msm_id, meas_start_time): {org_prb_id: [(timestamp, minimum_rtt)]}}
+        """
+        for (target_prb_id, msm_id, meas_start_time), origins in mesh_pings.items():
+            self.meta['msm'][str(msm_id)] = meas_start_time
+            for org_prb_id, pings in origins.items():
+                self.buf['target'].extend([target_prb_id] * len(pings))
+                self.buf['origin'].extend([org_prb_id] * len(pings))
+                self.buf['msm_id'].extend([msm_id] * len(pings))
+                self.buf['timestamp'].extend(p[0] for p in pings)
+                self.buf['min_rtt'].extend(p[1] for p in pings)
+            if len(self.buf['min_rtt']) >= self.chunk_rows:
+                self.flush()
+
+    def flush(self) -> None:
+        if not self.buf['min_rtt']:
+            return
+        cols = {c: np.array(self.buf[c], dtype=DTYPES[c]) for c in COLUMNS}
+        fname = f"{len(self.meta['chunks']):05d}.npz"
+        with open(os.path.join(self.fpath, fname), "wb") as f:
+            np.savez_compressed(f, **cols)
+        self.meta['chunks'].append({"file": fname, "rows": len(cols['min_rtt']),
+                                    "tmin": int(cols['timestamp'].min()), "tmax": int(cols['timestamp'].max()),
+                                    "targets": np.unique(cols['target']).tolist()})
+        self.buf = {c: [] for c in COLUMNS}
+
+    def close(self) -> None:
+        self.flush()
+        meta_path = os.path.join(self.fpath, "meta.json")
+        with open(meta_path + ".tmp", "wt") as f:
+            json.dump(self.meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def __enter__(self) -> "PingWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def load_meta(fpath: str) -> dict:
+    with open(os.path.join(fpath, "meta.json"), "rt") as f:
+        return json.load(f)
+
+
+def read(fpath: str, start: Optional[int] = None, stop: Optional[int] = None,
+         anchors: Optional[Iterable[int]] = None, columns: Iterable[str] = COLUMNS) -> Iterator[Dict[str, np.ndarray]]:
+    """ Rows of a columnar directory, one chunk at a time.
+    Args:
+        start, stop: keep start <= timestamp <= stop (unix timestamps, None: unbounded)
+        anchors: keep pings between two anchors of this subset (None: all)
+        columns: columns to return
+    Returns:
+        iterator over {column: array} of the rows of each chunk that pass the filters
+    """
+    subset = None if anchors is None else np.unique(np.fromiter(anchors, dtype=np.int64))
+    for chunk in load_meta(fpath)['chunks']:
+        if (start is not None and chunk['tmax'] < start) or (stop is not None and chunk['tmin'] > stop):
+            continue
+        if subset is not None and not np.isin(chunk['targets'], subset).any():
+            continue
+        with np.load(os.path.join(fpath, chunk['file'])) as d:
+            cols = {c: d[c] for c in set(columns) | {"timestamp", "target", "origin"}}
+        keep = np.ones(chunk['rows'], dtype=bool)
+        if start is not None:
+            keep &= cols['timestamp'] >= start
+        if stop is not None:
+            keep &= cols['timestamp'] <= stop
+        if subset is not None:
+            keep &= np.isin(cols['target'], subset) & np.isin(cols['origin'], subset)
+        if keep.any():
+            yield {c: cols[c][keep] for c in columns}
+
+
+def to_mesh_pings(fpath: str, **filters) -> dict:
+    """ read() back into the nested layout of retrieve_topo.py pickles. """
+    msm_start = {int(k): v for k, v in load_meta(fpath)['msm'].items()}
+    mesh_pings = {}
+    for cols in read(fpath, **filters):
+        for target, origin, msm_id, ts, rtt in zip(*(cols[c].tolist() for c in COLUMNS)):
+            key = (target, msm_id, msm_start[msm_id])
+            mesh_pings.setdefault(key, {}).setdefault(origin, []).append((ts, rtt))
+    return mesh_pings
@@ -0,0 +1,111 @@
+#! /usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Persistent cache of RIPE Atlas probe types (anchor or not), shared by all
+# threads and worker processes of a retrieval run through one SQLite file.
+
+import os
+import time
+import sqlite3
+import threading
+
+from typing import (
+    Dict,
+    Iterable,
+    Optional,
+)
+
+
+class ProbeCache:
+    """
+    Args:
+        fpath: SQLite file, created if missing
+        ttl: seconds after which an entry (or a bulk anchor listing) is refetched
+    """
+
+    def __init__(self, fpath: str = "../pickle/probe_cache.sqlite", ttl: float = 7 * 24 * 3600) -> None:
+        self.fpath = fpath
+        self.ttl = ttl
+        self.memo = {}  # {prb_id: is_anchor}, entries read or written by this process
+        self.hits = 0
+        self.misses = 0
+        self.listed = False  # warm() was called by this run (or the process it was forked from)
+        self.lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+        with self.lock:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS probes (prb_id INTEGER PRIMARY KEY, is_anchor INTEGER, fetched_at REAL);
+                CREATE TABLE IF NOT EXISTS listings (name TEXT PRIMARY KEY, fetched_at REAL);
+                CREATE TABLE IF NOT EXISTS stats (run TEXT PRIMARY KEY, hits INTEGER, misses INTEGER);
+            """)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # one connection per process: a connection must not cross a fork
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.fpath, timeout=60, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def listing_fresh(self) -> bool:
+        row = self.conn.execute("SELECT fetched_at FROM listings WHERE name = 'anchors'").fetchone()
+        return row is not None and time.time() - row[0] < self.ttl
+
+    def get(self, prb_id: int) -> Optional[bool]:
+        """ True/False if the type of prb_id is known and fresh, None otherwise. """
+        with self.lock:
+            if prb_id in self.memo:
+                self.hits += 1
+                return self.memo[prb_id]
+            row = self.conn.execute("SELECT is_anchor, fetched_at FROM probes WHERE prb_id = ?",
+                                    (prb_id,)).fetchone()
+            if row is not None and time.time() - row[1] < self.ttl:
+                is_anchor = bool(row[0])
+            elif self.listed and self.listing_fresh():
+                # not in this run's complete anchor listing: a regular probe
+                is_anchor = False
+            else:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.memo[prb_id] = is_anchor
+            return is_anchor
+
+    def put(self, prb_id: int, is_anchor: bool) -> None:
+        self.put_many({prb_id: is_anchor})
+
+    def put_many(self, types: Dict[int, bool]) -> None:
+        now = time.time()
+        with self.lock:
+            self.memo.update(types)
+            self.conn.executemany("INSERT OR REPLACE INTO probes VALUES (?, ?, ?)",
+                                  [(prb_id, int(is_anchor), now) for prb_id, is_anchor in types.items()])
+
+    def warm(self, anchor_prb_ids: Iterable[int]) -> None:
+        """ Pre-warm from one complete anchor listing of the current run: the
+        listed probes are anchors, and until the listing expires every other
+        probe is not. Without a call in this run, unlisted probes are fetched.
+        """
+        self.put_many({prb_id: True for prb_id in anchor_prb_ids})
+        with self.lock:
+            self.listed = True
+            self.conn.execute("INSERT OR REPLACE INTO listings VALUES ('anchors', ?)", (time.time(),))
+
+    def flush_stats(self, run: str) -> None:
+        """ Add this process's hit/miss counts to the totals of `run` and reset them. """
+        with self.lock:
+            self.conn.execute("INSERT INTO stats VALUES (?, ?, ?) ON CONFLICT(run) DO UPDATE "
+                              "SET hits = hits + excluded.hits, misses = misses + excluded.misses",
+                              (run, self.hits, self.misses))
+            self.hits = 0
+            self.misses = 0
+
+    def report(self, run: str) -> str:
+        """ Hit rate of `run` over all processes that flushed their stats. """
+        self.flush_stats(run)
+        hits, misses = self.conn.execute("SELECT hits, misses FROM stats WHERE run = ?", (run,)).fetchone()
+        total = hits + misses
+        rate = hits / total if total else 0.0
+        return f"probe cache: {hits}/{total} hits ({rate:.1%})"
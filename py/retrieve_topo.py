@@ -6,41 +6,123 @@
 #   ping (potentially traceroute) between one anchor and another,
 # for the RIPE anchors that are publicly accessible.
 
+import os
 import time
+import json
 import pickle
 from datetime import datetime, timedelta
+from typing import Iterator, Optional
 import multiprocessing as mp
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from ripe.atlas.cousteau import (
   Probe,
-  AtlasRequest,
   AtlasResultsRequest,
   MeasurementRequest
 )
 
+import atlas_client
+import geodist
+from probe_cache import ProbeCache
+from anchor_directory import AnchorDirectory
+from mesh_store import MeshStore
+import ping_table
+
 parallel = 1
-ANCHORS = set()
-NOTANCHORS = set()
+CONCURRENCY = 16  # > 0: fetch with a pool of this many threads through atlas_client, 0: mp.Pool of `parallel`
+RATE_LIMIT = 10  # requests per second per host with CONCURRENCY > 0
+ATLAS_URL = atlas_client.ATLAS_URL  # point to a local stub server for testing
+CLIENT = None  # atlas_client.AtlasClient with CONCURRENCY > 0, otherwise ripe.atlas.cousteau is used
+OUTPUT_FORMAT = "pickle"  # "pickle" (one dict at the end), "jsonl" (streamed line by line) or "columns" (ping_table)
+PROBE_CACHE = None  # ProbeCache shared by all threads/workers, opened in main()
+RUN_ID = None  # key of this run's hit/miss counts in PROBE_CACHE
+ANCHOR_DIR = None  # AnchorDirectory: target hostname/IP -> anchor, listed once in main()
+STORE_DIR = "../pickle/mesh_store"  # local result store with per-measurement covered ranges, None: no store
+STORE = None  # MeshStore of STORE_DIR, opened in main()
+ANCHOR_CSV = None  # e.g. "../csv/anchorSelectionAll.csv" to regenerate it from the anchor listing
+STREAM_RESULTS = True  # with CLIENT: parse results while they download instead of loading the whole list
+REDUCE_MIN = False  # keep only the minimum usable RTT per (measurement, origin) instead of every sample (no STORE)
+FPATH_LM_DISTANCE = "../pickle/lm_dist.npy"  # required with REDUCE_MIN: samples faster than light are never the minimum
+LM_DISTANCE = None  # geodist.DistanceStore of FPATH_LM_DISTANCE, loaded on first use
+
+def anchor_directory() -> AnchorDirectory:
+    global ANCHOR_DIR
+    if ANCHOR_DIR is None:
+        ANCHOR_DIR = AnchorDirectory(CLIENT)
+    return ANCHOR_DIR
+
+def is_anchor(prb_id: int) -> bool:
+    if PROBE_CACHE is not None:
+        cached = PROBE_CACHE.get(prb_id)
+        if cached is not None:
+            return cached
+    if CLIENT is not None:
+        is_success, probe = CLIENT.get_json(f"/api/v2/probes/{prb_id}/")
+        if not is_success:
+            raise IOError(f"fail to get probe info: {prb_id}")
+        probe_is_anchor = probe['is_anchor']
+    else:
+        probe_is_anchor = Probe(id=prb_id).is_anchor
+    if not probe_is_anchor:
+        print(f"{prb_id} is not anchor! skip!")
+    if PROBE_CACHE is not None:
+        PROBE_CACHE.put(prb_id, probe_is_anchor)
+    return probe_is_anchor
+
+def warm_probe_cache() -> None:
+    """ Mark all anchors of this run's anchor listing in PROBE_CACHE, so that
+    anchors added since the last run are never taken for regular probes.
+    """
+    if not anchor_directory().anchors:
+        return
+    PROBE_CACHE.warm(anchor_directory().probe_ids())
+
+def lm_distance() -> Optional[geodist.DistanceStore]:
+    global LM_DISTANCE
+    if LM_DISTANCE is None and os.path.exists(FPATH_LM_DISTANCE):
+        LM_DISTANCE = geodist.DistanceStore.load(FPATH_LM_DISTANCE)
+    return LM_DISTANCE
+
+def usable_rtt(rtt: float, dist: Optional[float]) -> bool:
+    """ Whether analyze_topo.py keeps the sample: positive and not faster than light over dist (km). """
+    return rtt > 0 and (dist is None or dist / (rtt / 2) <= geodist.SPEED_OF_LIGHT)
+
+def reduce_min(pings: list, one_meas: tuple, dist: Optional[float]) -> None:
+    """ Keep in `pings` a single sample: the smallest usable RTT seen so far.
+    An unusable sample is only kept while there is nothing better, so that the
+    origin is still listed (as analyze_topo.py would list it) without any edge.
+    """
+    if not pings:
+        pings.append(one_meas)
+    elif usable_rtt(one_meas[1], dist) and (not usable_rtt(pings[0][1], dist) or one_meas[1] < pings[0][1]):
+        pings[0] = one_meas
+
+def get_results(msm_id: int, start: int, stop: int) -> (bool, Iterator[dict]):
+    """ Results of one measurement between two unix timestamps. """
+    if CLIENT is not None:
+        url_path = f"/api/v2/measurements/{msm_id}/results/"
+        params = {"start": start, "stop": stop, "format": "json"}
+        if STREAM_RESULTS:
+            return CLIENT.iter_json(url_path, params)
+        return CLIENT.get_json(url_path, params)
+    # Anchor mesh measurement data is too big to call with AtlasRequest
+    # We need to use AtlasResultsRequest
+    filters2 = {"msm_id": msm_id,
+                "start": start,
+                "stop": stop}
+    return AtlasResultsRequest(**filters2).create()
 
 def retrieve_meas(msm: dict, current_time: datetime, time_window: timedelta) -> dict:
     stime = time.time()
     mesh_pings = {}
 
-    # get anchor info
-    url_path = "/api/v2/anchors/?search=" + msm['target']
-    # url_path ex:
+    # get anchor info from the prefetched anchor directory; targets missing from it are searched with
     # https://atlas.ripe.net//api/v2/anchors/?search=fr-sxb-as8839.anchors.atlas.ripe.net
-    request = AtlasRequest(**{"url_path": url_path})
-    (is_success, response) = request.get()
-    if not is_success:
-        print(f"fail to get anchor info: {url_path}")
+    anchor = anchor_directory().lookup(msm['target'])
+    if anchor is None:
         return None
-    try:
-        target_prb_id = response['results'][0]['probe']
-        if response['results'][0]['type'] != 'Anchor':
-            return None
-    except:
-        print(response['results'])
+    target_prb_id = anchor['probe']
+    if anchor.get('type') != 'Anchor':
         return None
 
     meas_start_time = datetime.fromtimestamp(msm['start_time']).strftime("%m-%d-%Y")
@@ -51,54 +133,99 @@ def retrieve_meas(msm: dict, current_time: datetime, time_window: timedelta) ->
         mesh_pings[key] = {}
 
     print(f"reading.. measurement id:{msm['id']}, probe id:{target_prb_id}")
-    # Anchor mesh measurement data is too big to call with AtlasRequest
-    # We need to use AtlasResultsRequest
-    filters2 = {"msm_id": msm['id'],
-                "start": current_time - time_window,
-                "stop": current_time}
-
-    is_success, results = AtlasResultsRequest(**filters2).create()
-    # Reference for format: https://atlas.ripe.net/docs/apis/result-format/
-    if not is_success:
-        print(f"fail to get measurements on: {msm['id']}")
-        return None
+    start = atlas_client.timestamp(current_time - time_window)
+    stop = atlas_client.timestamp(current_time)
+    # with a local store, only ask for what it does not cover yet
+    ranges = [(start, stop)] if STORE is None else STORE.missing(msm['id'], start, stop)
+    for start, stop in ranges:
+        is_success, results = get_results(msm['id'], start, stop)
+        # Reference for format: https://atlas.ripe.net/docs/apis/result-format/
+        if not is_success:
+            print(f"fail to get measurements on: {msm['id']}")
+            return None
 
-    for result in results:
         try:
-            org_prb_id = result['prb_id']
-            if org_prb_id in NOTANCHORS:
-                continue
-            if org_prb_id not in ANCHORS:
-                probe = Probe(id=org_prb_id)
-                if not probe.is_anchor:
-                    NOTANCHORS.add(org_prb_id)
-                    print(f"{org_prb_id} is not anchor! skip!")
-                    continue
-                ANCHORS.add(org_prb_id)
-            if org_prb_id not in mesh_pings[key]:
-                mesh_pings[key][org_prb_id] = []
-            one_meas = (result['timestamp'], result['min'])
-            mesh_pings[key][org_prb_id].append(one_meas)
-        except Exception as e:
-            print(e, result)
+            for result in results:
+                try:
+                    org_prb_id = result['prb_id']
+                    if not is_anchor(org_prb_id):
+                        continue
+                    if org_prb_id not in mesh_pings[key]:
+                        mesh_pings[key][org_prb_id] = []
+                    one_meas = (result['timestamp'], result['min'])
+                    if REDUCE_MIN:
+                        dist = None if lm_distance() is None else lm_distance().get(org_prb_id, target_prb_id)
+                        reduce_min(mesh_pings[key][org_prb_id], one_meas, dist)
+                    else:
+                        mesh_pings[key][org_prb_id].append(one_meas)
+                except Exception as e:
+                    print(e, result)
+                    return None
+        except (IOError, ValueError) as e:
+            # a streamed response broke off or is not valid JSON
+            print(f"fail to read measurements on: {msm['id']}: {e}")
             return None
 
-
+    if PROBE_CACHE is not None:
+        PROBE_CACHE.flush_stats(RUN_ID)
     time_taken = round(time.time() - stime)
     print(f"finishing.. {time_taken} seconds, meas id:{msm['id']}, {current_time}, probe id:{target_prb_id}")
     if len(mesh_pings[key]) == 0:
         return None
     return mesh_pings
 
+def write_jsonl(fp, mesh_pings: dict) -> None:
+    """ Append mesh pings to a line-delimited file read by analyze_topo.iter_jsonl_batches(),
+    one line per (measurement, origin).
+    """
+    for (target_prb_id, msm_id, meas_start_time), origins in mesh_pings.items():
+        for org_prb_id, pings in origins.items():
+            fp.write(json.dumps({"target": target_prb_id, "msm_id": msm_id, "start": meas_start_time,
+                                 "origin": org_prb_id, "pings": pings}) + "\n")
+
+def write_output(fp, mesh_pings: dict) -> None:
+    if OUTPUT_FORMAT == "jsonl":
+        write_jsonl(fp, mesh_pings)
+    else:
+        fp.write(mesh_pings)
+
 def run_retrieve_meas(args):
     return retrieve_meas(*args)
 
+def iter_retrieved(measurements, current_time: datetime, time_window: timedelta) -> Iterator[dict]:
+    """ retrieve_meas() over all measurements, in completion order.
+    With CLIENT set, a thread pool keeps at most CONCURRENCY requests in flight
+    (each host rate limited, failed requests retried with backoff by the client);
+    otherwise measurements are spread over an mp.Pool of `parallel` processes.
+    """
+    if CLIENT is not None:
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+            futures = [executor.submit(retrieve_meas, meas, current_time, time_window) for meas in measurements]
+            for future in as_completed(futures):
+                yield future.result()
+    else:
+        with mp.Pool(processes=parallel) as pool:
+            yield from pool.imap_unordered(run_retrieve_meas,
+                                           ((meas, current_time, time_window) for meas in measurements),
+                                           chunksize=3)
+
 def main() -> None:
     """
     get all measurements which have tag: anchoring, mesh
     Reference for API:
     https://atlas.ripe.net/docs/apis/rest-api-reference/#measurements
     """
+    global CLIENT, PROBE_CACHE, RUN_ID, ANCHOR_DIR, STORE
+    PROBE_CACHE = ProbeCache("../pickle/probe_cache.sqlite")
+    if CONCURRENCY > 0:
+        CLIENT = atlas_client.AtlasClient(ATLAS_URL, rate=RATE_LIMIT)
+    ANCHOR_DIR = AnchorDirectory(CLIENT)
+    if STORE_DIR is not None and not REDUCE_MIN:
+        # a min-reduced result does not cover its window: never store it
+        STORE = MeshStore(STORE_DIR)
+    if REDUCE_MIN and lm_distance() is None:
+        # without distances, a sample faster than light could be kept as the minimum
+        raise IOError(f"REDUCE_MIN needs the anchor distances: {FPATH_LM_DISTANCE}")
     time_windows = [timedelta(hours=1)]
     for time_window in time_windows:
         print(str(time_window))
@@ -107,28 +234,66 @@ def main() -> None:
                    "type": "ping",
                    "af": 4,
                    "status": 2}  # status 2 (ongoing)
-        measurements = MeasurementRequest(**filters)
+        if CONCURRENCY > 0:
+            params = dict(filters, tags=",".join(filters["tags"]))
+            measurements = list(CLIENT.iter_pages("/api/v2/measurements/", params))
+            total_count = len(measurements)
+        else:
+            measurements = MeasurementRequest(**filters)
+        RUN_ID = datetime.now().isoformat()
+        try:
+            anchor_directory().refresh()
+        except Exception as e:
+            # not fatal: targets are then searched one by one
+            print(f"fail to list anchors: {e}")
+        if ANCHOR_CSV is not None:
+            anchor_directory().to_csv(ANCHOR_CSV)
+        warm_probe_cache()
         mesh_pings = {}
 
         stime = time.time()
         current_time = datetime.now()
         # current_time = datetime(2022, 12, 8, 0, 00)
         str_current_time = current_time.strftime("%m-%d-%Y")
-        with mp.Pool(processes=parallel) as pool:
-
-            for result in pool.imap_unordered(run_retrieve_meas,
-                                              ((meas, current_time, time_window) for meas in measurements),
-                                              chunksize=3):
+        fpath = "../pickle/mesh_pings_"  + str_current_time + '_' + str(time_window).split(' ')[0] + "." + OUTPUT_FORMAT
+        if OUTPUT_FORMAT == "jsonl":
+            fp = open(fpath, "wt")
+        elif OUTPUT_FORMAT == "columns":
+            fp = ping_table.PingWriter(fpath)
+        else:
+            fp = None
+        for result in iter_retrieved(measurements, current_time, time_window):
 
-                if result is not None:
+            if result is not None:
+                if STORE is not None:
+                    STORE.append(result, atlas_client.timestamp(current_time - time_window),
+                                 atlas_client.timestamp(current_time))
+                elif fp is not None:
+                    write_output(fp, result)
+                else:
                     mesh_pings.update(result)
 
-        with open("../pickle/mesh_pings_"  + str_current_time + '_' + str(time_window).split(' ')[0] + ".pickle", "wb") as f:
-            pickle.dump(mesh_pings, f)
+        if STORE is not None:
+            STORE.save()
+            # the whole window is served locally: results of earlier runs plus the ones just fetched
+            mesh_pings = STORE.window(atlas_client.timestamp(current_time - time_window),
+                                      atlas_client.timestamp(current_time))
+            if fp is not None:
+                write_output(fp, mesh_pings)
+
+        if fp is not None:
+            fp.close()
+        else:
+            with open(fpath, "wb") as f:
+                pickle.dump(mesh_pings, f)
 
         etime = time.time() - stime
         print(f"total time: {etime}")
-        print(f"total measurement count: {measurements.total_count}")
+        if CONCURRENCY == 0:
+            total_count = measurements.total_count
+        print(f"total measurement count: {total_count}")
+        print(PROBE_CACHE.report(RUN_ID))
+        print(f"anchor searches outside the directory: {anchor_directory().searches}")
 
 
 
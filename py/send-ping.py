@@ -7,8 +7,14 @@
 
 
 from datetime import datetime  
+import os
 import csv
+import json
 import time
+import heapq
+import threading
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from ripe.atlas.cousteau import (
   Ping,
   Traceroute,
@@ -17,6 +23,22 @@ from ripe.atlas.cousteau import (
   AtlasResultsRequest
 )
 
+import atlas_client
+
+ATLAS_URL = atlas_client.ATLAS_URL  # point to a local stub server for testing
+BATCH_SIZE = 10  # ping definitions (targets) per create request
+CONCURRENCY = 4  # create requests in flight
+RATE = 1.0  # create requests per second to start with, adapted to the API's 429 responses
+MAX_RATE = 4.0
+MIN_RATE = 0.05
+MAX_THROTTLED = 8  # 429 responses to one create request before it is given up
+FPATH_IDS = '../csv/measurement_id_ping.csv'
+FPATH_RESULTS = '../pickle/ping_results.jsonl'  # one line per finished measurement
+POLL_DELAY = 30.0  # seconds before a measurement is polled again, doubled on every poll
+MAX_POLL_DELAY = 600.0
+POLL_TIMEOUT = 3600.0  # seconds after which measurements that did not finish are given up
+FINISHED_STATUS = {4, 5, 6, 7, 8}  # stopped, forced to stop, no suitable probes, failed, archived
+
 def get_API_key() -> str:
     """ Return RIPE API KEY by reading it from a file.
     A file, api_key, is required and the file should contain
@@ -24,7 +46,7 @@ def get_API_key() -> str:
     :return key: (str): API key
     """
     with open("api_key", "r") as f:
-        key = f.readline()
+        key = f.readline().strip()
     return key
 
 def set_ping(target: str, desc: str) -> Ping:
@@ -106,6 +128,193 @@ def get_results(meas_id: str) -> (bool, list):
     return (is_success, results)
 
 
+class SubmitScheduler:
+    """ Submit one-off pings to many targets, several targets per create request.
+    Requests are paced by a token bucket (atlas_client.RateLimiter) whose rate is
+    halved on every 429 of the API (waiting for Retry-After when given) and raised
+    again step by step on success. Measurement ids are appended to `fpath` as soon
+    as their request returns; targets already listed there are skipped, so an
+    interrupted run can simply be started again.
+    :param api_key: (str): API key
+    :param source: (AtlasSource): probes of every measurement, built once
+    :param fpath: (str): csv of (target, measurement id) rows
+    """
+
+    def __init__(self, api_key: str, source: AtlasSource, fpath: str = FPATH_IDS,
+                 base_url: str = ATLAS_URL, rate: float = RATE) -> None:
+        # create requests are not retried blindly: a request that timed out may have been created
+        self.client = atlas_client.AtlasClient(base_url, rate=rate, retries=0, key=api_key)
+        self.client.limiter.burst = 1
+        self.host = urlsplit(self.client.url("/")).netloc
+        self.source = source.build_api_struct()
+        self.fpath = fpath
+        self.lock = threading.Lock()
+
+    def submitted(self) -> set:
+        """ Targets with a measurement id in self.fpath """
+        if not os.path.exists(self.fpath):
+            return set()
+        with open(self.fpath, 'r') as f:
+            return {row[0] for row in csv.reader(f) if row}
+
+    def throttle(self, response) -> None:
+        limiter = self.client.limiter
+        with self.lock:
+            limiter.rate = max(MIN_RATE, limiter.rate / 2)
+            retry_after = response.headers.get("Retry-After", "")
+            limiter.slow_down(self.host, float(retry_after) if retry_after.isdigit() else 1 / limiter.rate)
+        print(f"rate limited: {limiter.rate:.2f} requests/s")
+
+    def speed_up(self) -> None:
+        with self.lock:
+            self.client.limiter.rate = min(MAX_RATE, self.client.limiter.rate + RATE / 4)
+
+    def create(self, meas: list) -> (bool, dict):
+        """ One create request for a list of measurements (retried only on 429,
+        at most MAX_THROTTLED times).
+        :return is_success: (bool): True if the measurements were created
+        :return response: (dict): {"measurements": [ids in the order of meas]},
+            or the error (requests.Response or exception)
+        """
+        data = {"definitions": [m.build_api_struct() for m in meas],
+                "probes": [self.source],
+                "is_oneoff": True}
+        for _ in range(MAX_THROTTLED + 1):
+            is_success, response = self.client.request("POST", "/api/v2/measurements/", json=data)
+            if getattr(response, "status_code", None) != 429:
+                break
+            self.throttle(response)
+        if not is_success:
+            return False, response
+        self.speed_up()
+        return True, response.json()
+
+    def record(self, targets: list, msm_ids: list) -> None:
+        with self.lock:
+            with open(self.fpath, 'a') as csvoutput:
+                writer = csv.writer(csvoutput)
+                for target, msm in zip(targets, msm_ids):
+                    writer.writerow([target, msm])
+
+    def submit_batch(self, targets: list, desc: str) -> int:
+        """ Submit a batch; a batch the API rejects as a whole (4xx other than 429,
+        e.g. one private target) is split in halves and resubmitted, so that
+        only the offending targets are left unsubmitted.
+        :return count: (int): number of targets submitted
+        """
+        is_success, response = self.create([set_ping(target, desc) for target in targets])
+        print(is_success, getattr(response, "text", response), targets)
+        if is_success:
+            self.record(targets, response['measurements'])
+            return len(targets)
+        status = getattr(response, "status_code", None)
+        if len(targets) > 1 and status is not None and 400 <= status < 500 and status != 429:
+            half = len(targets) // 2
+            return self.submit_batch(targets[:half], desc) + self.submit_batch(targets[half:], desc)
+        return 0
+
+    def submit(self, targets: list, desc: str, batch_size: int = BATCH_SIZE) -> int:
+        """ Submit pings to all targets not submitted yet.
+        :return count: (int): number of targets submitted by this call
+        """
+        done = self.submitted()
+        todo = [target for target in dict.fromkeys(targets) if target not in done]
+        batches = [todo[i:i + batch_size] for i in range(0, len(todo), batch_size)]
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+            return sum(executor.map(lambda batch: self.submit_batch(batch, desc), batches))
+
+
+class ResultCollector:
+    """ Collect the results of many one-off measurements at once.
+    At most CONCURRENCY polls are in flight; every measurement is polled on its
+    own schedule (POLL_DELAY, doubled up to MAX_POLL_DELAY) until its status is
+    final, then its results are streamed from the API and appended to `fpath`
+    as one line {"target", "msm_id", "results"}. Measurements already in
+    `fpath` are skipped.
+    :param fpath: (str): line-delimited output
+    :param base_url: (str): API server, e.g. a local stub for testing
+    """
+
+    def __init__(self, fpath: str = FPATH_RESULTS, base_url: str = ATLAS_URL,
+                 poll_delay: float = POLL_DELAY, timeout: float = POLL_TIMEOUT) -> None:
+        self.client = atlas_client.AtlasClient(base_url, rate=MAX_RATE)
+        self.fpath = fpath
+        self.poll_delay = poll_delay
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def collected(self) -> set:
+        """ Measurement ids with results in self.fpath """
+        if not os.path.exists(self.fpath):
+            return set()
+        with open(self.fpath, 'r') as f:
+            return {json.loads(line)['msm_id'] for line in f if line.strip()}
+
+    def poll(self, msm_id: int, target: str) -> bool:
+        """ Write the results of msm_id if it is finished.
+        :return is_finished: (bool): False if it has to be polled again
+        """
+        is_success, msm = self.client.get_json(f"/api/v2/measurements/{msm_id}/")
+        if not is_success or msm['status']['id'] not in FINISHED_STATUS:
+            return False
+        is_success, results = self.client.iter_json(f"/api/v2/measurements/{msm_id}/results/", {"format": "json"})
+        if not is_success:
+            return False
+        try:
+            line = json.dumps({"target": target, "msm_id": msm_id, "results": list(results)})
+        except (IOError, ValueError) as e:
+            print(f"fail to read results of: {msm_id}: {e}")
+            return False
+        with self.lock:
+            with open(self.fpath, 'a') as f:
+                f.write(line + "\n")
+        return True
+
+    def collect(self, measurements: dict) -> int:
+        """ Poll {msm_id: target} until every measurement finished or timed out.
+        :return count: (int): number of measurements written by this call
+        """
+        deadline = time.monotonic() + self.timeout
+        done = self.collected()
+        # (next poll time, msm_id, delay before the poll after it)
+        pending = [(time.monotonic(), msm_id, self.poll_delay) for msm_id in measurements if msm_id not in done]
+        heapq.heapify(pending)
+        running = {}
+        count = 0
+        with ThreadPoolExecutor(max_workers=CONCURRENCY) as executor:
+            while pending or running:
+                now = time.monotonic()
+                while pending and pending[0][0] <= now and len(running) < CONCURRENCY:
+                    _, msm_id, delay = heapq.heappop(pending)
+                    running[executor.submit(self.poll, msm_id, measurements[msm_id])] = (msm_id, delay)
+                if not running:
+                    time.sleep(pending[0][0] - now)
+                    continue
+                timeout = max(0.0, pending[0][0] - now) if pending and len(running) < CONCURRENCY else None
+                finished, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    msm_id, delay = running.pop(future)
+                    try:
+                        is_finished = future.result()
+                    except Exception as e:
+                        # e.g. an unexpected or non-JSON reply: poll it again later, like an unfinished one
+                        print(f"fail to poll measurement: {msm_id}: {e!r}")
+                        is_finished = False
+                    if is_finished:
+                        count += 1
+                    elif time.monotonic() + delay > deadline:
+                        print(f"fail to get results in time: {msm_id}, {measurements[msm_id]}")
+                    else:
+                        heapq.heappush(pending, (time.monotonic() + delay, msm_id, min(MAX_POLL_DELAY, 2 * delay)))
+        return count
+
+
+def read_measurement_ids(fpath: str = FPATH_IDS) -> dict:
+    """ {msm_id: target} of the rows written by SubmitScheduler """
+    with open(fpath, 'r') as f:
+        return {int(row[1]): row[0] for row in csv.reader(f) if row}
+
+
 def main():
     atlas_api_key = get_API_key()
     description = "testing"
@@ -113,35 +322,20 @@ def main():
     file = csv.DictReader(f)
     
     target_list = []
-    measurement_id_list_ping = {}
     #store all of the IP addresses of the targeted VPN servers
     for col in file:
         target_list.append(col['ip'])
-        
-    #for every target in the target list
-    for target in target_list:
-
-        ping_obj = set_ping(target, description)
-        source = set_src()
-
-        time.sleep(20)
-        is_exp_success_ping, response = run_exp(atlas_api_key, [ping_obj], [source])
+    f.close()
 
-        print(is_exp_success_ping, response, target)
-        if is_exp_success_ping:
-            id_ping = response['measurements']
-            measurement_id_list_ping[str(target)] = str(id_ping)
-    
-    with open('../csv/measurement_id_ping.csv', 'a') as csvoutput: #replace w with a for other files
-        writer = csv.writer(csvoutput)
-        # writer = csv.writer(csvoutput, lineterminator='\n')
-        # fieldnames = ["measurement id"] writer = csv.writer(csvoutput, fieldnames=fieldnames)
-        # writer.writerow(["IP","measurement id"])
-        for key in measurement_id_list_ping.keys():
-            msm = measurement_id_list_ping[key].replace("[","").replace("]","")
-            writer.writerow([key] + [msm])
+    stime = time.time()
+    # the probe source is the same for every target: build it once
+    scheduler = SubmitScheduler(atlas_api_key, set_src())
+    count = scheduler.submit(target_list, description)
+    print(f"submitted: {count}/{len(target_list)} targets, {time.time() - stime:.1f} seconds")
 
-    f.close()
+    # results of every submitted measurement, including the ones of earlier runs
+    count = ResultCollector().collect(read_measurement_ids())
+    print(f"collected: {count} measurements, {time.time() - stime:.1f} seconds")
     
     
 